@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 import json
 
 from app.auth.models import User, AgentProfile, ActivityLog, UserRole, ApprovalStatus
+from app.auth.principal_cache import principal_cache
 from app.property.models import UserProperty
 
 
@@ -78,6 +79,7 @@ def approve_agent(db: Session, agent_id: int, admin_id: int):
     )
     
     db.commit()
+    principal_cache.invalidate_user(agent_id)
     db.refresh(agent)
     
     return {
@@ -119,6 +121,7 @@ def reject_agent(db: Session, agent_id: int, admin_id: int, reason: str):
     )
     
     db.commit()
+    principal_cache.invalidate_user(agent_id)
     db.refresh(agent)
     
     return {
@@ -337,6 +340,7 @@ def suspend_user(db: Session, user_id: int, admin_id: int, reason: str):
     )
     
     db.commit()
+    principal_cache.invalidate_user(user_id)
     
     return {
         "message": "User suspended successfully",
@@ -369,6 +373,7 @@ def unsuspend_user(db: Session, user_id: int, admin_id: int):
     )
     
     db.commit()
+    principal_cache.invalidate_user(user_id)
     
     return {
         "message": "User unsuspended successfully",
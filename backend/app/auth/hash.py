@@ -1,10 +1,109 @@
+import asyncio
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
-password_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 
-class Hash:
-    def bcrypt(password: str):
-        return password_context.hash(password)
-    
-    def verify(hashed_password, plain_password):
-        return password_context.verify(plain_password, hashed_password)
\ No newline at end of file
+# bcrypt cost; hashes made with any other cost are upgraded on the next login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+# Threads dedicated to hashing (bcrypt releases the GIL while it works)
+HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", max(1, min(4, (os.cpu_count() or 2) // 2))))
+# Hash/verify jobs allowed to run or wait at once; beyond it requests get 503
+HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 32))
+
+password_context = CryptContext(
+    schemes=['bcrypt'],
+    deprecated='auto',
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on its own bounded thread pool, off the event loop and away
+    from the threads serving requests.
+
+    At most HASH_MAX_PENDING jobs run or queue at once, so a login burst is
+    shed with 503 instead of piling up behind the CPU.
+    """
+
+    def __init__(self, workers: int = HASH_WORKERS, max_pending: int = HASH_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_wait = 0.0
+        self.dummy_hash: Optional[str] = None
+
+    async def _run(self, func, *args):
+        # Only touched from the event loop, so plain counters are enough
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many sign-in requests right now, please try again shortly",
+                headers={"Retry-After": "1"}
+            )
+
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            result = func(*args)
+            return result, started - submitted, time.perf_counter() - started
+
+        self.pending += 1
+        try:
+            result, waited, ran = await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self.pending -= 1
+
+        self.completed += 1
+        self.wait_time += waited
+        self.run_time += ran
+        self.max_wait = max(self.max_wait, waited)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(password_context.hash, password)
+
+    async def verify(self, hashed_password: str, plain_password: str) -> tuple[bool, Optional[str]]:
+        """(valid, new hash) - the new hash is set when the stored one uses an outdated cost"""
+        valid, new_hash = await self._run(password_context.verify_and_update, plain_password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return valid, new_hash
+
+    async def dummy_verify(self, plain_password: str):
+        """Spend the same bcrypt work as a real verify, for logins to unknown accounts"""
+        if self.dummy_hash is None:
+            self.dummy_hash = await self.hash(secrets.token_urlsafe(16))
+        await self._run(password_context.verify, plain_password, self.dummy_hash)
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "mean_wait_ms": round(self.wait_time / self.completed * 1000, 3) if self.completed else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "mean_run_ms": round(self.run_time / self.completed * 1000, 3) if self.completed else 0.0
+        }
+
+
+password_hasher = PasswordHasher()
@@ -1,11 +1,15 @@
 from fastapi import HTTPException, status, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime
-import cloudinary.uploader
 import os
 
 from app.auth.models import User, AgentProfile, KYCStatus
+from app.auth.principal_cache import principal_cache
 from app.auth.kyc_schemas import KYCSubmission, KYCStatusUpdate, KYCDisplay, AgentWarning
+from app.storage import get_storage
 
 
 # Anti-abuse thresholds
@@ -47,15 +51,16 @@ def submit_kyc(db: Session, agent_id: int, kyc_data: KYCSubmission) -> KYCDispla
     user.kyc_submitted_at = datetime.utcnow()
     
     db.commit()
+    principal_cache.invalidate_user(agent_id)
     db.refresh(user)
     db.refresh(agent_profile)
     
     return build_kyc_display(user, agent_profile)
 
 
-async def upload_kyc_documents(db: Session, agent_id: int, government_id: UploadFile, selfie: UploadFile):
-    """Upload KYC documents to Cloudinary"""
-    user = db.query(User).filter(User.id == agent_id).first()
+async def upload_kyc_documents(db: AsyncSession, agent_id: int, government_id: UploadFile, selfie: UploadFile):
+    """Upload KYC documents to the media storage"""
+    user = await db.get(User, agent_id)
     
     if not user or user.role != "agent":
         raise HTTPException(
@@ -63,7 +68,9 @@ async def upload_kyc_documents(db: Session, agent_id: int, government_id: Upload
             detail="Only agents can upload KYC documents"
         )
     
-    agent_profile = db.query(AgentProfile).filter(AgentProfile.user_id == agent_id).first()
+    agent_profile = (await db.execute(
+        select(AgentProfile).where(AgentProfile.user_id == agent_id)
+    )).scalars().first()
     if not agent_profile:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -71,18 +78,25 @@ async def upload_kyc_documents(db: Session, agent_id: int, government_id: Upload
         )
     
     try:
+        storage = get_storage()
+        
+        # Storage backends do blocking file/HTTP I/O, so keep them off the loop
         # Upload government ID
-        gov_id_result = cloudinary.uploader.upload(
+        gov_id_result = await run_in_threadpool(
+            storage.upload,
             government_id.file,
             folder=f"real_estate/kyc/government_ids/{agent_id}",
-            resource_type="auto"
+            resource_type="auto",
+            filename=government_id.filename
         )
         
         # Upload selfie
-        selfie_result = cloudinary.uploader.upload(
+        selfie_result = await run_in_threadpool(
+            storage.upload,
             selfie.file,
             folder=f"real_estate/kyc/selfies/{agent_id}",
-            resource_type="image"
+            resource_type="image",
+            filename=selfie.filename
         )
         
         # Update agent profile
@@ -91,7 +105,7 @@ async def upload_kyc_documents(db: Session, agent_id: int, government_id: Upload
         agent_profile.selfie_url = selfie_result['secure_url']
         agent_profile.selfie_public_id = selfie_result['public_id']
         
-        db.commit()
+        await db.commit()
         
         return {
             "message": "KYC documents uploaded successfully",
@@ -133,6 +147,7 @@ def admin_update_kyc_status(
         user.kyc_rejection_reason = update.rejection_reason
     
     db.commit()
+    principal_cache.invalidate_user(agent_id)
     db.refresh(user)
     
     return build_kyc_display(user, agent_profile)
@@ -268,6 +283,7 @@ def flag_buyer_for_abuse(db: Session, buyer_id: int, reason: str):
         user.flag_reason = reason
         user.last_flag_date = datetime.utcnow()
         db.commit()
+        principal_cache.invalidate_user(buyer_id)
 
 
 def check_buyer_no_shows(db: Session, buyer_id: int):
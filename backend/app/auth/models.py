@@ -112,9 +112,20 @@ class ActivityLog(Base):
 
 
 class TokenBlacklist(Base):
+    """Legacy full-token blacklist; only read until its rows expire (see RevokedToken)"""
     __tablename__ = "token_blacklist"
     
     id = Column(Integer, primary_key=True, index=True)
     token = Column(String, unique=True, index=True, nullable=False)
     blacklisted_on = Column(DateTime, default=datetime.utcnow)
-    expires_at = Column(DateTime, nullable=False)
\ No newline at end of file
+    expires_at = Column(DateTime, nullable=False)
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    # sha256 of the token's jti, never the token itself
+    jti_hash = Column(String(64), unique=True, nullable=False)
+    revoked_at = Column(DateTime, default=datetime.utcnow, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
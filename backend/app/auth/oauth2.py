@@ -5,10 +5,13 @@ from typing import Optional
 from datetime import datetime, timedelta
 from jose import jwt
 import os
+import uuid
 import dotenv
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.auth.models import User
+from app.auth.principal_cache import principal_cache
+from app.auth.revocation import revocation_key, revocations
 
 dotenv.load_dotenv()
 
@@ -23,7 +26,8 @@ REFRESH_TOKEN_EXPIRE_DAYS = 14
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    # jti identifies the token for revocation
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     
     # Debug: Print what we're encoding
     print(f"DEBUG - Creating token with payload: {to_encode}")
@@ -35,7 +39,7 @@ def create_access_token(data: dict):
 def generate_refresh_token(user_data: dict, custom_expiry: Optional[timedelta] = None):
     payload = user_data.copy()
     expiration_time = datetime.utcnow() + (custom_expiry or timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
-    payload.update({"exp": expiration_time, "token_category": "refresh"})
+    payload.update({"exp": expiration_time, "token_category": "refresh", "jti": uuid.uuid4().hex})
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -74,7 +78,14 @@ def decode_refresh_token(refresh_token: str):
 
 
 
-def get_current_user(token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
+def get_user_from_token(token: str, db: Session) -> User:
+    """
+    Resolve a bearer token to its user, raising 401 if it is invalid or revoked.
+
+    Revocation is checked against the in-memory index, and recently decoded
+    tokens and users come from principal_cache, so the common path never
+    touches the database.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -82,28 +93,43 @@ def get_current_user(token: str = Depends(oauth2_schema), db: Session = Depends(
     )
     
     try:
+        principal = principal_cache.token_principal(token)
+        if principal is None:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id: int = payload.get("user_id")
+            
+            if user_id is None:
+                raise credentials_exception
+            
+            key = revocation_key(payload, token)
+            principal_cache.remember_token(token, user_id, key, payload.get("exp"))
+        else:
+            user_id, key = principal
+        
         # Check if user is logged out
-        from app.auth.models import TokenBlacklist
-        blacklisted = db.query(TokenBlacklist).filter(TokenBlacklist.token == token).first()
-        if blacklisted:
+        if not revocations.loaded:
+            revocations.refresh(db)
+        if revocations.is_revoked(key):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token has been revoked",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("user_id")
-        
-        if user_id is None:
-            raise credentials_exception
-        
-        user = db.query(User).filter(User.id == user_id).first()
-        
+        user = principal_cache.get_user(user_id)
         if user is None:
-            raise credentials_exception
+            user = db.query(User).filter(User.id == user_id).first()
+            
+            if user is None:
+                raise credentials_exception
+            
+            principal_cache.remember_user(user)
             
         return user
         
     except JWTError as e:
-        raise credentials_exception
\ No newline at end of file
+        raise credentials_exception
+
+
+def get_current_user(token: str = Depends(oauth2_schema), db: Session = Depends(get_db)):
+    return get_user_from_token(token, db)
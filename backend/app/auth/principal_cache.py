@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.auth.models import User
+
+
+# Seconds a checked token or a loaded user row is reused without the database (0 = off)
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", 30))
+# Entries kept per cache; the least recently used go first
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+
+USER_COLUMNS = tuple(column.key for column in User.__table__.columns)
+
+
+class LRUCache:
+    """LRU map whose entries also expire; locked because sync routes authenticate on worker threads"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value, ttl: float):
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class PrincipalCache:
+    """
+    Authenticated principals, so the common request needs no database.
+
+    Tokens map to the user id they were issued for and their revocation
+    key once decoded (revocation itself is checked on every request);
+    users map to a snapshot of their columns. A hit hands out a fresh
+    detached User each time, so nothing stale lands in a request's session;
+    callers must not assume the user belongs to their session.
+
+    Writes in this process invalidate entries straight away; other workers
+    pick the change up once their entry expires, after AUTH_CACHE_TTL.
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_size: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.tokens = LRUCache(max_size)
+        self.users = LRUCache(max_size)
+
+    def token_principal(self, token: str) -> Optional[Tuple[int, str]]:
+        """(user id, revocation key) of a recently decoded token"""
+        return self.tokens.get(token)
+
+    def remember_token(self, token: str, user_id: int, revocation_key: str, expires_at: Optional[float]):
+        ttl = self.ttl
+        if expires_at is not None:
+            # Never outlive the token itself
+            ttl = min(ttl, expires_at - time.time())
+        self.tokens.set(token, (user_id, revocation_key), ttl)
+
+    def forget_token(self, token: str):
+        self.tokens.discard(token)
+
+    def get_user(self, user_id: int) -> Optional[User]:
+        values = self.users.get(user_id)
+        if values is None:
+            return None
+        user = User(**values)
+        make_transient_to_detached(user)
+        return user
+
+    def remember_user(self, user: User):
+        state = inspect(user).dict
+        # Only cache complete rows; a partially loaded one would lazy-load once detached
+        if all(column in state for column in USER_COLUMNS):
+            self.users.set(user.id, {column: state[column] for column in USER_COLUMNS}, self.ttl)
+
+    def invalidate_user(self, user_id: int):
+        self.users.discard(user_id)
+
+    def snapshot(self) -> dict:
+        return {
+            "ttl_seconds": self.ttl,
+            "tokens": len(self.tokens),
+            "users": len(self.users),
+            "token_hits": self.tokens.hits,
+            "token_misses": self.tokens.misses,
+            "user_hits": self.users.hits,
+            "user_misses": self.users.misses
+        }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,69 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from fastapi import HTTPException, status
+
+
+# Login attempts one client IP can make in a burst, and how fast they refill
+LOGIN_IP_BURST = float(os.environ.get("LOGIN_IP_BURST", 20))
+LOGIN_IP_PER_MINUTE = float(os.environ.get("LOGIN_IP_PER_MINUTE", 10))
+# The same for one account (username or email as typed), whatever the IP
+LOGIN_ACCOUNT_BURST = float(os.environ.get("LOGIN_ACCOUNT_BURST", 5))
+LOGIN_ACCOUNT_PER_MINUTE = float(os.environ.get("LOGIN_ACCOUNT_PER_MINUTE", 3))
+# Buckets kept per limiter; the least recently used are dropped first
+MAX_BUCKETS = 100000
+
+
+class TokenBucketLimiter:
+    """
+    In-memory token buckets, one per key.
+
+    Each attempt takes a token; buckets refill continuously up to their
+    burst size. Only used from the event loop, so no locking.
+    """
+
+    def __init__(self, burst: float, per_minute: float, max_buckets: int = MAX_BUCKETS):
+        self.burst = burst
+        self.rate = per_minute / 60
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict = OrderedDict()
+
+    def take(self, key: Hashable) -> Optional[float]:
+        """Take a token; returns None if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            return (1 - tokens) / self.rate if self.rate > 0 else 60.0
+
+        self._buckets[key] = (tokens - 1, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return None
+
+
+class LoginThrottle:
+    """Per-IP and per-account limits checked before any password is hashed"""
+
+    def __init__(self):
+        self.ips = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE)
+        self.accounts = TokenBucketLimiter(LOGIN_ACCOUNT_BURST, LOGIN_ACCOUNT_PER_MINUTE)
+
+    def check(self, client_ip: str, username: str):
+        retry_after = self.ips.take(client_ip) or self.accounts.take(username.strip().lower())
+        if retry_after is not None:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many login attempts, please try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+
+login_throttle = LoginThrottle()
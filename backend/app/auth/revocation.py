@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from app.auth.models import RevokedToken, TokenBlacklist
+
+
+# Seconds between reads of revocations made by other workers
+REFRESH_INTERVAL = float(os.environ.get("TOKEN_REVOCATION_REFRESH_SECONDS", 5))
+# Minutes between purges of expired revocations from the database
+PURGE_INTERVAL = float(os.environ.get("TOKEN_REVOCATION_PURGE_MINUTES", 60)) * 60
+# Each refresh re-reads this far back, so rows committed out of order are not missed
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+def revocation_key(payload: dict, token: str) -> str:
+    """sha256 of the token's jti; tokens issued before jtis existed hash the whole token"""
+    return hashlib.sha256((payload.get("jti") or token).encode()).hexdigest()
+
+
+class RevocationIndex:
+    """
+    Live token revocations held in memory, so checking a token is a dict lookup.
+
+    Loaded in full on first use, then refreshed incrementally with the rows
+    revoked since the previous read. Entries and rows are dropped once the
+    token would have expired anyway, so both stay bounded by the number of
+    revoked tokens still alive.
+    """
+
+    def __init__(self):
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.last_read: Optional[datetime] = None
+
+    def add(self, key: str, expires_at: float):
+        self._revoked[key] = expires_at
+
+    def is_revoked(self, key: str) -> bool:
+        expires_at = self._revoked.get(key)
+        return expires_at is not None and expires_at > time.time()
+
+    def refresh(self, db: Session):
+        with self._lock:
+            read_at = datetime.utcnow()
+            query = db.query(RevokedToken.jti_hash, RevokedToken.expires_at).filter(
+                RevokedToken.expires_at > read_at
+            )
+            if self.last_read is not None:
+                query = query.filter(RevokedToken.revoked_at >= self.last_read - REFRESH_OVERLAP)
+            for key, expires_at in query:
+                self._revoked[key] = expires_at.replace(tzinfo=timezone.utc).timestamp()
+
+            if not self.loaded:
+                # Legacy rows hold the whole token, with expiry in server local time
+                for token, expires_at in db.query(TokenBlacklist.token, TokenBlacklist.expires_at).filter(
+                    TokenBlacklist.expires_at > datetime.now()
+                ):
+                    self._revoked[revocation_key({}, token)] = expires_at.timestamp()
+
+            self.last_read = read_at
+            self.loaded = True
+
+    def purge(self, db: Session) -> int:
+        """Delete expired revocations from the database and from memory"""
+        purged = db.query(RevokedToken).filter(
+            RevokedToken.expires_at <= datetime.utcnow()
+        ).delete(synchronize_session=False)
+        purged += db.query(TokenBlacklist).filter(
+            TokenBlacklist.expires_at <= datetime.now()
+        ).delete(synchronize_session=False)
+        db.commit()
+
+        now = time.time()
+        self._revoked = {key: expires_at for key, expires_at in self._revoked.items() if expires_at > now}
+        return purged
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+revocations = RevocationIndex()
+
+
+async def run_revocation_refresher(session_factory):
+    """Background loop pulling in other workers' revocations and purging expired ones"""
+    def refresh():
+        with session_factory() as db:
+            revocations.refresh(db)
+
+    def purge():
+        with session_factory() as db:
+            return revocations.purge(db)
+
+    last_purge = 0.0
+    while True:
+        try:
+            await run_in_threadpool(refresh)
+            if time.monotonic() - last_purge >= PURGE_INTERVAL:
+                last_purge = time.monotonic()
+                purged = await run_in_threadpool(purge)
+                if purged:
+                    print(f"Token revocations: {purged} expired rows purged")
+        except Exception as e:
+            print(f"Token revocation refresh failed: {str(e)}")
+        await asyncio.sleep(REFRESH_INTERVAL)
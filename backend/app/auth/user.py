@@ -1,20 +1,26 @@
 import datetime
 import os
 from fastapi import HTTPException, status
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session
 from sqlalchemy.exc import IntegrityError
 from jose import JWTError
-from .hash import Hash
-from .models import TokenBlacklist, User
+from .hash import password_hasher
+from .models import RevokedToken, User
 from .oauth2 import create_access_token, generate_refresh_token, create_verification_token, verify_token
+from .principal_cache import principal_cache
+from .revocation import revocation_key, revocations
 from .schemas import UserBase
 from app.config import send_email  # Changed: Import send_email from config
 from jose import jwt
 
 
-async def create_user(db: Session, request: UserBase):
+async def create_user(db: AsyncSession, request: UserBase):
     # Check if username already exists
-    existing_username = db.query(User).filter(User.username == request.username).first()
+    existing_username = (await db.execute(
+        select(User.id).where(User.username == request.username)
+    )).first()
     if existing_username:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -22,7 +28,9 @@ async def create_user(db: Session, request: UserBase):
         )
     
     # Check if email already exists
-    existing_email = db.query(User).filter(User.email == request.email).first()
+    existing_email = (await db.execute(
+        select(User.id).where(User.email == request.email)
+    )).first()
     if existing_email:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -35,7 +43,7 @@ async def create_user(db: Session, request: UserBase):
             first_name = request.first_name,
             last_name = request.last_name,
             username = request.username,
-            password = Hash.bcrypt(request.password),
+            password = await password_hasher.hash(request.password),
             is_verified = False,
             role = request.role
         )
@@ -49,50 +57,62 @@ async def create_user(db: Session, request: UserBase):
             new_user.approval_status = "approved"
         
         db.add(new_user)
-        db.flush()
+        await db.flush()
         
         try:
             await send_verification_email(new_user.email, new_user.id)
         except Exception as e:
-            db.rollback()
+            await db.rollback()
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to send verification email. Please try again later or contact support. Error: {str(e)}"
             )
         
         # Email sent successfully, save user
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
 
         return new_user
     
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username or email already exists"
         )
     
 
-def login_user(db: Session, username: str, password: str):
-    # filter by username or email
-    user = db.query(User).filter(User.username == username).first() or db.query(User).filter(User.email == username).first()
+async def login_user(db: AsyncSession, username: str, password: str):
+    # filter by username or email in one query; a username match wins over an email one
+    users = (await db.execute(
+        select(User).where(or_(User.username == username, User.email == username)).limit(2)
+    )).scalars().all()
+    user = next((u for u in users if u.username == username), users[0] if users else None)
     
     if not user:
+        # Same bcrypt cost as a wrong password, so response time doesn't reveal unknown accounts
+        await password_hasher.dummy_verify(password)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password",
             headers={"WWW-Authenticate": "Bearer"}
         )
     
-    # Verify password
-    if not Hash.verify(user.password, password):
+    # Verify password on the hashing pool
+    valid, new_hash = await password_hasher.verify(user.password, password)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username or password",
             headers={"WWW-Authenticate": "Bearer"}
         )
     
+    # The bcrypt cost changed since this hash was made: store an upgraded one
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
+        principal_cache.invalidate_user(user.id)
+    
     # Check if user is verified
     if not user.is_verified:
         raise HTTPException(
@@ -120,7 +140,7 @@ def login_user(db: Session, username: str, password: str):
     }
 
 
-async def verify_email(token: str, db: Session):
+async def verify_email(token: str, db: AsyncSession):
     try:
         payload = verify_token(token)
         
@@ -138,7 +158,7 @@ async def verify_email(token: str, db: Session):
             )
         
         # Get user from database
-        user_obj = db.query(User).filter(User.id == user_id).first()
+        user_obj = await db.get(User, user_id)
         if not user_obj:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -150,7 +170,8 @@ async def verify_email(token: str, db: Session):
         
         # Update user's verification status
         user_obj.is_verified = True
-        db.commit()
+        await db.commit()
+        principal_cache.invalidate_user(user_id)
         
         return {"message": "Email verified successfully"}
     
@@ -297,7 +318,7 @@ def user_profile(db: Session, user_id: int):
 
 def logout_user(db: Session, token: str):
     """
-    Blacklist the token to prevent further use
+    Revoke the token (by its hashed jti) to prevent further use
     """
     try:
         # Decode token to get expiration
@@ -305,14 +326,18 @@ def logout_user(db: Session, token: str):
         exp_timestamp = payload.get("exp")
         
         if exp_timestamp:
-            expires_at = datetime.datetime.fromtimestamp(exp_timestamp)
+            key = revocation_key(payload, token)
+            if revocations.is_revoked(key):
+                return {"message": "Successfully logged out"}
             
-            blacklisted_token = TokenBlacklist(
-                token=token,
-                expires_at=expires_at
+            revoked_token = RevokedToken(
+                jti_hash=key,
+                expires_at=datetime.datetime.utcfromtimestamp(exp_timestamp)
             )
-            db.add(blacklisted_token)
+            db.add(revoked_token)
             db.commit()
+            revocations.add(key, exp_timestamp)
+            principal_cache.forget_token(token)
             
             return {"message": "Successfully logged out"}
         else:
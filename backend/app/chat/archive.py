@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, or_, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.chat.models import ArchiveSegment, Conversation, Message, Notification
+
+
+# Read messages and notifications older than this move to the archive (0 = never)
+ARCHIVE_AFTER_DAYS = float(os.environ.get("CHAT_ARCHIVE_AFTER_DAYS", 180))
+# Hours between archiver passes
+ARCHIVE_INTERVAL = float(os.environ.get("CHAT_ARCHIVE_INTERVAL_HOURS", 24)) * 3600
+# Rows per compressed segment
+SEGMENT_SIZE = 500
+# Conversations (or users) loaded per batch while scanning for candidates
+ARCHIVE_BATCH = 200
+# PostgreSQL advisory lock key held by the worker running a pass
+ARCHIVE_LOCK_KEY = 4210042
+
+MESSAGE_FIELDS = ("id", "conversation_id", "sender_id", "content", "is_read", "read_at", "created_at")
+NOTIFICATION_FIELDS = (
+    "id", "user_id", "message_id", "conversation_id", "notification_type", "related_id",
+    "title", "body", "count", "is_read", "read_at", "created_at"
+)
+DATETIME_FIELDS = ("read_at", "created_at")
+
+
+def _encode(rows: list, fields: tuple) -> bytes:
+    lines = []
+    for row in rows:
+        record = {}
+        for field in fields:
+            value = getattr(row, field)
+            record[field] = value.isoformat() if isinstance(value, datetime) else value
+        lines.append(json.dumps(record, separators=(",", ":")))
+    return zlib.compress("\n".join(lines).encode())
+
+
+def _decode(payload: bytes) -> List[dict]:
+    records = []
+    for line in zlib.decompress(payload).decode().splitlines():
+        record = json.loads(line)
+        for field in DATETIME_FIELDS:
+            if record.get(field):
+                record[field] = datetime.fromisoformat(record[field])
+        records.append(record)
+    return records
+
+
+def _add_segment(db: Session, kind: str, owner_id: int, rows: list, fields: tuple):
+    db.add(ArchiveSegment(
+        kind=kind,
+        owner_id=owner_id,
+        first_row_id=rows[0].id,
+        last_row_id=rows[-1].id,
+        first_created_at=rows[0].created_at,
+        last_created_at=rows[-1].created_at,
+        row_count=len(rows),
+        payload=_encode(rows, fields)
+    ))
+
+
+def archive_conversation(db: Session, conversation_id: int, is_active: bool, cutoff: datetime) -> int:
+    """
+    Move the conversation's oldest read messages into archive segments.
+
+    Only a prefix of the history (by id) is ever archived, so every message
+    still in the hot table is newer than every archived one. Closed
+    conversations are archived regardless of age; unread messages and
+    anything after them always stay hot.
+    """
+    query = db.query(func.max(Message.id)).filter(Message.conversation_id == conversation_id)
+    if is_active:
+        query = query.filter(Message.created_at < cutoff)
+    boundary = query.scalar()
+    if boundary is None:
+        return 0
+
+    first_unread = db.query(func.min(Message.id)).filter(
+        Message.conversation_id == conversation_id,
+        Message.is_read == False
+    ).scalar()
+    if first_unread is not None:
+        boundary = min(boundary, first_unread - 1)
+
+    archived = 0
+    while True:
+        messages = db.query(Message).filter(
+            Message.conversation_id == conversation_id,
+            Message.id <= boundary
+        ).order_by(Message.id).limit(SEGMENT_SIZE).all()
+        if not messages:
+            break
+
+        message_ids = [message.id for message in messages]
+        _add_segment(db, "messages", conversation_id, messages, MESSAGE_FIELDS)
+        # Readers only look in the archive when this says there is something there
+        db.query(Conversation).filter(Conversation.id == conversation_id).update(
+            {Conversation.archived_through: messages[-1].id, Conversation.updated_at: Conversation.updated_at},
+            synchronize_session=False
+        )
+        # Notifications outlive the messages they point at
+        db.query(Notification).filter(Notification.message_id.in_(message_ids)).update(
+            {Notification.message_id: None}, synchronize_session=False
+        )
+        deleted = db.query(Message).filter(Message.id.in_(message_ids)).delete(synchronize_session=False)
+        if deleted != len(messages):
+            # Another archiver moved these rows first; don't store them twice
+            db.rollback()
+            break
+        db.commit()
+        archived += len(messages)
+
+    return archived
+
+
+def archive_notifications(db: Session, user_id: int, cutoff: datetime) -> int:
+    """Move a user's read notifications older than the cutoff into archive segments"""
+    archived = 0
+    while True:
+        notifications = db.query(Notification).filter(
+            Notification.user_id == user_id,
+            Notification.is_read == True,
+            Notification.created_at < cutoff
+        ).order_by(Notification.id).limit(SEGMENT_SIZE).all()
+        if not notifications:
+            break
+
+        _add_segment(db, "notifications", user_id, notifications, NOTIFICATION_FIELDS)
+        deleted = db.query(Notification).filter(
+            Notification.id.in_([notification.id for notification in notifications])
+        ).delete(synchronize_session=False)
+        if deleted != len(notifications):
+            # Another archiver moved these rows first; don't store them twice
+            db.rollback()
+            break
+        db.commit()
+        archived += len(notifications)
+
+    return archived
+
+
+def run_archive_pass(db: Session, now: Optional[datetime] = None) -> tuple[int, int]:
+    """Archive everything eligible; returns (messages, notifications) moved"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+    messages = notifications = 0
+
+    last_id = 0
+    while True:
+        conversations = db.query(Conversation.id, Conversation.is_active).filter(
+            Conversation.id > last_id,
+            or_(Conversation.is_active == False, Conversation.created_at < cutoff)
+        ).order_by(Conversation.id).limit(ARCHIVE_BATCH).all()
+        if not conversations:
+            break
+        last_id = conversations[-1].id
+        for conversation_id, is_active in conversations:
+            messages += archive_conversation(db, conversation_id, is_active is not False, cutoff)
+
+    user_ids = [user_id for user_id, in db.query(Notification.user_id).filter(
+        Notification.is_read == True,
+        Notification.created_at < cutoff
+    ).distinct().all()]
+    for user_id in user_ids:
+        notifications += archive_notifications(db, user_id, cutoff)
+
+    return messages, notifications
+
+
+def load_archived_messages(db: Session, conversation_id: int, before_id: Optional[int], limit: int) -> List[Message]:
+    """
+    Archived messages of a conversation older than before_id, newest first.
+
+    Returned as detached Message instances so callers can treat them like
+    rows from the hot table.
+    """
+    query = db.query(ArchiveSegment).filter(
+        ArchiveSegment.kind == "messages",
+        ArchiveSegment.owner_id == conversation_id
+    )
+    if before_id is not None:
+        query = query.filter(ArchiveSegment.first_row_id < before_id)
+    query = query.order_by(ArchiveSegment.last_row_id.desc())
+
+    messages: List[Message] = []
+    for segment in query.yield_per(4):
+        for record in reversed(_decode(segment.payload)):
+            if before_id is not None and record["id"] >= before_id:
+                continue
+            messages.append(Message(**record))
+            if len(messages) >= limit:
+                return messages
+    return messages
+
+
+def load_archived_messages_after(db: Session, conversation_id: int, after_id: int, limit: int) -> List[Message]:
+    """Archived messages of a conversation newer than after_id, oldest first (detached, like above)"""
+    segments = db.query(ArchiveSegment).filter(
+        ArchiveSegment.kind == "messages",
+        ArchiveSegment.owner_id == conversation_id,
+        ArchiveSegment.last_row_id > after_id
+    ).order_by(ArchiveSegment.last_row_id)
+
+    messages: List[Message] = []
+    for segment in segments.yield_per(4):
+        for record in _decode(segment.payload):
+            if record["id"] <= after_id:
+                continue
+            messages.append(Message(**record))
+            if len(messages) >= limit:
+                return messages
+    return messages
+
+
+@contextmanager
+def archive_lock(engine: Engine):
+    """
+    Yields whether this worker may run a pass: on PostgreSQL only the one
+    holding the advisory lock does, the others skip the round.
+    """
+    if engine.dialect.name != "postgresql":
+        yield True
+        return
+
+    # A connection of its own, since the pass commits (and returns its
+    # connection to the pool) after every segment
+    with engine.connect() as conn:
+        acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ARCHIVE_LOCK_KEY}).scalar()
+        conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ARCHIVE_LOCK_KEY})
+                conn.commit()
+
+
+async def run_archiver(session_factory, interval: Optional[float] = None):
+    """Background loop that periodically archives old chat rows off the event loop"""
+    def archive():
+        with session_factory() as db, archive_lock(db.get_bind()) as acquired:
+            if not acquired:
+                return 0, 0
+            return run_archive_pass(db)
+
+    while ARCHIVE_AFTER_DAYS > 0:
+        await asyncio.sleep(interval or ARCHIVE_INTERVAL)
+        try:
+            messages, notifications = await run_in_threadpool(archive)
+            if messages or notifications:
+                print(f"Chat archive: {messages} messages, {notifications} notifications moved")
+        except Exception as e:
+            print(f"Chat archive pass failed: {str(e)}")
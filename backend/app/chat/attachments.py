@@ -0,0 +1,216 @@
+import io
+import os
+from collections import defaultdict
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+from PIL import Image
+from pypdf import PdfReader
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.auth.models import User
+from app.chat.models import Conversation, Message, MessageAttachment
+from app.chat.schemas import AttachmentResponse
+from app.storage import MediaStorage, get_storage, sniff_media_type
+
+
+# Largest accepted attachment
+MAX_ATTACHMENT_BYTES = int(float(os.environ.get("CHAT_ATTACHMENT_MAX_MB", 25)) * 1024 * 1024)
+# Bounding box for image thumbnails
+THUMBNAIL_SIZE = (320, 320)
+# Largest image (width x height) decoded for a thumbnail; bigger ones are refused
+MAX_IMAGE_PIXELS = int(os.environ.get("CHAT_ATTACHMENT_MAX_PIXELS", 40_000_000))
+
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif"}
+PDF_TYPES = {"application/pdf"}
+# Declared types that name the same format under another spelling
+TYPE_ALIASES = {"image/jpg": "image/jpeg", "image/pjpeg": "image/jpeg", "application/x-pdf": "application/pdf"}
+
+
+def _attachment_kind(file: UploadFile) -> Tuple[str, str]:
+    """
+    (kind, media type) from the file's leading bytes; never from what the
+    client declared, which only has to agree when it is given.
+    """
+    head = file.file.read(16)
+    file.file.seek(0)
+    media_type = sniff_media_type(head)
+    if media_type in IMAGE_TYPES:
+        kind = "image"
+    elif media_type in PDF_TYPES:
+        kind = "pdf"
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only images (JPEG, PNG, WebP, GIF) and PDF files can be attached"
+        )
+
+    declared = (file.content_type or "").split(";")[0].strip().lower()
+    declared = TYPE_ALIASES.get(declared, declared)
+    if declared and declared != "application/octet-stream" and declared != media_type:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File content does not match its type"
+        )
+    return kind, media_type
+
+
+def _image_preview(source: BinaryIO) -> Tuple[Tuple[int, int], io.BytesIO]:
+    """Size and a small JPEG thumbnail of an image; 400 if it can't be decoded safely"""
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+            # Checked before anything is decoded, so a small file can't expand into gigabytes
+            if width * height > MAX_IMAGE_PIXELS:
+                raise Image.DecompressionBombError(f"{width}x{height} image")
+            # JPEGs decode straight at a reduced scale instead of full size
+            image.draft("RGB", THUMBNAIL_SIZE)
+            image.thumbnail(THUMBNAIL_SIZE)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            thumbnail = io.BytesIO()
+            image.save(thumbnail, "JPEG", quality=80)
+    except Image.DecompressionBombError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Image dimensions are too large"
+        )
+    except Exception as e:
+        print(f"Image attachment rejected: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid image file"
+        )
+    thumbnail.seek(0)
+    return (width, height), thumbnail
+
+
+def _pdf_preview(source: BinaryIO) -> Tuple[int, Optional[str]]:
+    """Page count and title of a PDF; 400 if it can't be parsed"""
+    try:
+        reader = PdfReader(source)
+        page_count = len(reader.pages)
+        title = str(reader.metadata.title)[:200] if reader.metadata and reader.metadata.title else None
+    except Exception as e:
+        # pypdf raises PyPdfError and plenty of other types on malformed input
+        print(f"PDF attachment rejected: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid PDF file"
+        )
+    return page_count, title
+
+
+def upload_attachment(db: Session, conversation: Conversation, current_user: User, file: UploadFile) -> AttachmentResponse:
+    """
+    Store an uploaded file for a conversation and build its preview.
+
+    The upload is already spooled to a temporary file by the multipart
+    parser; the storage backend reads it in chunks, so the whole file is
+    never held in memory. It stays unattached until a message claims it.
+    """
+    kind, media_type = _attachment_kind(file)
+    if file.size is not None and file.size > MAX_ATTACHMENT_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Attachment is too large"
+        )
+
+    # Parsed before anything is stored, so a file that can't be read is refused
+    if kind == "image":
+        size, thumbnail = _image_preview(file.file)
+    else:
+        page_count, title = _pdf_preview(file.file)
+    file.file.seek(0)
+
+    storage = get_storage()
+    folder = f"real_estate/chat/{conversation.id}"
+    try:
+        result = storage.upload(
+            file.file,
+            folder=folder,
+            resource_type="image" if kind == "image" else "auto",
+            filename=file.filename
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error uploading attachment: {str(e)}"
+        )
+
+    attachment = MessageAttachment(
+        conversation_id=conversation.id,
+        uploader_id=current_user.id,
+        kind=kind,
+        filename=(file.filename or "")[:255] or None,
+        content_type=media_type,
+        size=result.get("bytes") or file.size,
+        url=result["secure_url"],
+        public_id=result["public_id"]
+    )
+
+    if kind == "image":
+        attachment.width, attachment.height = size
+        try:
+            stored = storage.upload(thumbnail, folder=f"{folder}/thumbnails", filename="thumbnail.jpg")
+            attachment.thumbnail_url = stored["secure_url"]
+            attachment.thumbnail_public_id = stored["public_id"]
+        except Exception as e:
+            print(f"Thumbnail upload failed: {str(e)}")
+    else:
+        attachment.page_count, attachment.title = page_count, title
+
+    db.add(attachment)
+    db.commit()
+    db.refresh(attachment)
+
+    return AttachmentResponse.model_validate(attachment)
+
+
+def claim_attachments(db: Session, message: Message, attachment_ids: List[int], current_user: User):
+    """Link the sender's unclaimed uploads in this conversation to a new message"""
+    attachment_ids = set(attachment_ids)
+    if not attachment_ids:
+        return
+
+    claimed = db.query(MessageAttachment).filter(
+        MessageAttachment.id.in_(attachment_ids),
+        MessageAttachment.uploader_id == current_user.id,
+        MessageAttachment.conversation_id == message.conversation_id,
+        MessageAttachment.message_id == None
+    ).update({MessageAttachment.message_id: message.id}, synchronize_session=False)
+
+    if claimed != len(attachment_ids):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid attachment"
+        )
+
+
+def attachment_ids_by_message(db: Session, message_ids: List[int]) -> Dict[int, List[int]]:
+    """Attachment ids for a page of messages, in one indexed query"""
+    attachments = defaultdict(list)
+    if not message_ids:
+        return attachments
+
+    rows = db.query(MessageAttachment.message_id, MessageAttachment.id).filter(
+        MessageAttachment.message_id.in_(message_ids)
+    ).order_by(MessageAttachment.id).all()
+    for message_id, attachment_id in rows:
+        attachments[message_id].append(attachment_id)
+    return attachments
+
+
+def get_attachments(db: Session, attachment_ids: List[int], current_user: User) -> List[AttachmentResponse]:
+    """Attachment details, limited to conversations the user takes part in"""
+    attachments = db.query(MessageAttachment).join(
+        Conversation, Conversation.id == MessageAttachment.conversation_id
+    ).filter(
+        MessageAttachment.id.in_(attachment_ids),
+        or_(Conversation.buyer_id == current_user.id, Conversation.agent_id == current_user.id),
+        # Uploads not yet sent in a message are private to the uploader
+        or_(MessageAttachment.message_id != None, MessageAttachment.uploader_id == current_user.id)
+    ).order_by(MessageAttachment.id).all()
+
+    return [AttachmentResponse.model_validate(attachment) for attachment in attachments]
@@ -0,0 +1,407 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Set
+
+from app.chat.presence import PRESENCE_TTL
+
+
+CHAT_BACKPLANE = os.environ.get("CHAT_BACKPLANE", "")  # "", memory, redis or postgres
+CHAT_BACKPLANE_URL = os.environ.get("CHAT_BACKPLANE_URL") or os.environ.get("REDIS_URL")
+CHAT_BACKPLANE_CHANNEL = os.environ.get("CHAT_BACKPLANE_CHANNEL", "chat_events")
+
+# Identifies this process to the other workers
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+class Backplane(ABC):
+    """
+    Pub/sub bus shared by all workers.
+
+    Every worker subscribes once and receives every event; it then delivers
+    the event to the sockets it holds locally. Presence (which workers hold
+    which user) lets a publisher skip the bus when nobody else needs it.
+    Each worker's entries expire after PRESENCE_TTL unless the heartbeat
+    refreshes them, so a worker that dies without saying so drops out.
+    """
+
+    def __init__(self, worker_id: str = WORKER_ID):
+        self.worker_id = worker_id
+        self.handler: Optional[EventHandler] = None
+        # user id -> {worker id: wall-clock expiry}
+        self.presence: Dict[int, Dict[str, float]] = {}
+
+    async def start(self, handler: EventHandler):
+        self.handler = handler
+
+    async def stop(self):
+        self.handler = None
+
+    @abstractmethod
+    async def publish(self, event: dict):
+        """Send an event to every other worker"""
+
+    async def set_presence(self, user_id: int, online: bool):
+        self._apply_presence(user_id, self.worker_id, online)
+
+    async def refresh_presence(self, user_ids: Iterable[int]):
+        """Extend this worker's presence for the users it still holds (called by the heartbeat)"""
+        for user_id in user_ids:
+            self._apply_presence(user_id, self.worker_id, True)
+
+    async def remote_workers(self, user_id: int) -> Set[str]:
+        """Workers other than this one holding sockets for the user"""
+        workers = self.presence.get(user_id)
+        if not workers:
+            return set()
+        now = time.time()
+        for worker_id in [worker_id for worker_id, expires in workers.items() if expires <= now]:
+            del workers[worker_id]
+        if not workers:
+            del self.presence[user_id]
+        return set(workers) - {self.worker_id}
+
+    def _apply_presence(self, user_id: int, worker_id: str, online: bool, ttl: float = PRESENCE_TTL):
+        workers = self.presence.setdefault(user_id, {})
+        if online:
+            workers[worker_id] = time.time() + ttl
+        else:
+            workers.pop(worker_id, None)
+            if not workers:
+                del self.presence[user_id]
+
+    async def _dispatch(self, event: dict):
+        if event.get("origin") == self.worker_id or self.handler is None:
+            return
+        await self.handler(event)
+
+
+class _InMemoryBroker:
+    def __init__(self):
+        self.subscribers: list = []
+        self.presence: Dict[int, Dict[str, float]] = {}
+
+
+class InMemoryBackplane(Backplane):
+    """Single-process bus; several instances sharing a broker behave like separate workers"""
+
+    default_broker = _InMemoryBroker()
+
+    def __init__(self, worker_id: str = WORKER_ID, broker: Optional[_InMemoryBroker] = None):
+        super().__init__(worker_id)
+        self.broker = broker or self.default_broker
+        self.presence = self.broker.presence
+
+    async def start(self, handler: EventHandler):
+        await super().start(handler)
+        self.broker.subscribers.append(self)
+
+    async def stop(self):
+        if self in self.broker.subscribers:
+            self.broker.subscribers.remove(self)
+        for user_id in [uid for uid, workers in self.presence.items() if self.worker_id in workers]:
+            self._apply_presence(user_id, self.worker_id, False)
+        await super().stop()
+
+    async def publish(self, event: dict):
+        event = json.loads(json.dumps({**event, "origin": self.worker_id}))
+        await asyncio.gather(*(subscriber._dispatch(event) for subscriber in list(self.broker.subscribers)))
+
+
+class RedisBackplane(Backplane):
+    """
+    Redis (or any Redis-protocol broker) pub/sub.
+
+    Presence is one sorted set per user, scored by each worker's expiry;
+    members past their score are ignored and trimmed, and the key itself
+    expires once no worker refreshes it.
+    """
+
+    def __init__(self, url: str, channel: str = CHAT_BACKPLANE_CHANNEL, worker_id: str = WORKER_ID):
+        super().__init__(worker_id)
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("CHAT_BACKPLANE=redis requires the 'redis' package")
+        self.redis = redis.from_url(url, decode_responses=True)
+        self.channel = channel
+        self.pubsub = None
+        self.listener: Optional[asyncio.Task] = None
+        self.local_users: Set[int] = set()
+
+    def _presence_key(self, user_id: int) -> str:
+        return f"{self.channel}:workers:{user_id}"
+
+    async def start(self, handler: EventHandler):
+        await super().start(handler)
+        self.pubsub = self.redis.pubsub()
+        await self.pubsub.subscribe(self.channel)
+        self.listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self.listener:
+            self.listener.cancel()
+        for user_id in list(self.local_users):
+            await self.set_presence(user_id, False)
+        if self.pubsub:
+            await self.pubsub.unsubscribe(self.channel)
+            await self.pubsub.aclose()
+        await self.redis.aclose()
+        await super().stop()
+
+    async def _listen(self):
+        async for item in self.pubsub.listen():
+            if item.get("type") != "message":
+                continue
+            try:
+                await self._dispatch(json.loads(item["data"]))
+            except Exception as e:
+                print(f"Backplane event failed: {str(e)}")
+
+    async def publish(self, event: dict):
+        await self.redis.publish(self.channel, json.dumps({**event, "origin": self.worker_id}))
+
+    async def set_presence(self, user_id: int, online: bool):
+        if online:
+            self.local_users.add(user_id)
+            await self.refresh_presence([user_id])
+        else:
+            self.local_users.discard(user_id)
+            await self.redis.zrem(self._presence_key(user_id), self.worker_id)
+
+    async def refresh_presence(self, user_ids: Iterable[int]):
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                key = self._presence_key(user_id)
+                pipe.zremrangebyscore(key, "-inf", now)
+                pipe.zadd(key, {self.worker_id: now + PRESENCE_TTL})
+                pipe.expire(key, int(PRESENCE_TTL) + 1)
+            await pipe.execute()
+
+    async def remote_workers(self, user_id: int) -> Set[str]:
+        workers = await self.redis.zrangebyscore(self._presence_key(user_id), time.time(), "+inf")
+        return set(workers) - {self.worker_id}
+
+
+class PostgresBackplane(Backplane):
+    """
+    LISTEN/NOTIFY on the application database.
+
+    The listening connection is registered with the event loop as a reader, so
+    waiting for notifications never blocks. Presence is gossiped on the same
+    channel and mirrored in memory by every worker, expiring unless the
+    holding worker re-announces it. Events too big for a
+    NOTIFY payload are stored in a small spill table and announced by id.
+    """
+
+    # NOTIFY payloads are limited to 8000 bytes by Postgres
+    MAX_PAYLOAD = 7900
+    SPILL_TABLE = "chat_backplane_spill"
+    # Spilled events are kept this long for every worker to fetch
+    SPILL_RETENTION = "5 minutes"
+    # Longest wait between attempts to restore a lost LISTEN connection
+    MAX_RECONNECT_DELAY = 30
+
+    def __init__(self, dsn: str, channel: str = CHAT_BACKPLANE_CHANNEL, worker_id: str = WORKER_ID):
+        super().__init__(worker_id)
+        self.dsn = dsn.replace("postgresql+psycopg2://", "postgresql://")
+        self.channel = channel
+        self.listen_conn = None
+        self.notify_conn = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.local_users: Set[int] = set()
+        self.reconnecting: Optional[asyncio.Task] = None
+
+    def _connect(self):
+        import psycopg2
+        import psycopg2.extensions
+
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn
+
+    def _listen(self):
+        conn = self._connect()
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return conn
+
+    def _setup(self):
+        notify_conn = self._connect()
+        with notify_conn.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.SPILL_TABLE} ("
+                "id BIGSERIAL PRIMARY KEY, payload TEXT NOT NULL, "
+                "created_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            )
+        return notify_conn, self._listen()
+
+    async def start(self, handler: EventHandler):
+        await super().start(handler)
+        self.loop = asyncio.get_running_loop()
+
+        # psycopg2 connects and runs statements synchronously: keep it off the loop
+        self.notify_conn, self.listen_conn = await self.loop.run_in_executor(None, self._setup)
+        self.loop.add_reader(self.listen_conn.fileno(), self._on_readable)
+
+        # Ask the other workers who they currently hold
+        await self._notify({"kind": "presence_sync"})
+
+    async def stop(self):
+        if self.reconnecting is not None:
+            self.reconnecting.cancel()
+        for user_id in list(self.local_users):
+            await self.set_presence(user_id, False)
+        self._drop_listener()
+        if self.notify_conn is not None:
+            await self.loop.run_in_executor(None, self.notify_conn.close)
+        await super().stop()
+
+    def _drop_listener(self):
+        if self.listen_conn is None:
+            return
+        try:
+            self.loop.remove_reader(self.listen_conn.fileno())
+        except Exception:
+            pass  # fileno() fails once the connection is already gone
+        self.listen_conn.close()
+        self.listen_conn = None
+
+    def _on_readable(self):
+        import psycopg2
+
+        try:
+            self.listen_conn.poll()
+        except psycopg2.Error as e:
+            print(f"Backplane LISTEN connection lost: {str(e)}")
+            self._drop_listener()
+            self.reconnecting = self.loop.create_task(self._reconnect())
+            return
+
+        while self.listen_conn.notifies:
+            notify = self.listen_conn.notifies.pop(0)
+            try:
+                event = json.loads(notify.payload)
+            except ValueError:
+                continue
+            self.loop.create_task(self._handle(event))
+
+    async def _reconnect(self):
+        import psycopg2
+
+        delay = 1
+        while self.handler is not None:
+            await asyncio.sleep(delay)
+            try:
+                self.listen_conn = await self.loop.run_in_executor(None, self._listen)
+            except psycopg2.Error as e:
+                print(f"Backplane reconnect failed, retrying in {delay}s: {str(e)}")
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+                continue
+
+            self.loop.add_reader(self.listen_conn.fileno(), self._on_readable)
+            print("Backplane LISTEN connection restored")
+            # Presence may have changed while we weren't listening
+            await self._notify({"kind": "presence_sync"})
+            await self._announce_presence(self.local_users, True)
+            return
+
+    async def _handle(self, event: dict):
+        kind = event.get("kind")
+        if kind == "spill":
+            if event.get("origin") == self.worker_id:
+                return
+            payload = await self.loop.run_in_executor(None, self._fetch_spilled, event["id"])
+            if payload is None:
+                print(f"Backplane spilled event {event['id']} expired before it was read")
+                return
+            await self._handle(json.loads(payload))
+        elif kind == "presence":
+            if event.get("origin") != self.worker_id:
+                # "user_id" is what workers running older code send
+                user_ids = event.get("user_ids") or [event["user_id"]]
+                for user_id in user_ids:
+                    self._apply_presence(user_id, event["origin"], event["online"], event.get("ttl", PRESENCE_TTL))
+        elif kind == "presence_sync":
+            if event.get("origin") != self.worker_id:
+                await self._announce_presence(self.local_users, True)
+        else:
+            await self._dispatch(event)
+
+    def _on_notify_conn(self, run):
+        """Run a statement on the notify connection, reconnecting once if it was lost"""
+        import psycopg2
+
+        try:
+            with self.notify_conn.cursor() as cursor:
+                return run(cursor)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.notify_conn = self._connect()
+            with self.notify_conn.cursor() as cursor:
+                return run(cursor)
+
+    def _fetch_spilled(self, spill_id: int) -> Optional[str]:
+        def fetch(cursor):
+            cursor.execute(f"SELECT payload FROM {self.SPILL_TABLE} WHERE id = %s", (spill_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        return self._on_notify_conn(fetch)
+
+    def _notify_sync(self, payload: str):
+        def notify(cursor):
+            if len(payload.encode()) <= self.MAX_PAYLOAD:
+                cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+                return
+            # Too big for NOTIFY: store the event and announce a reference to it
+            cursor.execute(
+                f"DELETE FROM {self.SPILL_TABLE} WHERE created_at < now() - interval '{self.SPILL_RETENTION}'"
+            )
+            cursor.execute(
+                f"WITH spilled AS (INSERT INTO {self.SPILL_TABLE} (payload) VALUES (%s) RETURNING id) "
+                "SELECT pg_notify(%s, json_build_object('kind', 'spill', 'id', id, 'origin', %s)::text) FROM spilled",
+                (payload, self.channel, self.worker_id)
+            )
+        self._on_notify_conn(notify)
+
+    async def _notify(self, event: dict):
+        # Non-ASCII text stays as UTF-8 instead of 6-byte escapes
+        payload = json.dumps({**event, "origin": self.worker_id}, ensure_ascii=False)
+        await self.loop.run_in_executor(None, self._notify_sync, payload)
+
+    async def publish(self, event: dict):
+        await self._notify(event)
+
+    async def _announce_presence(self, user_ids: Iterable[int], online: bool):
+        user_ids = list(user_ids)
+        if user_ids:
+            await self._notify({"kind": "presence", "user_ids": user_ids, "online": online, "ttl": PRESENCE_TTL})
+
+    async def set_presence(self, user_id: int, online: bool):
+        if online:
+            self.local_users.add(user_id)
+        else:
+            self.local_users.discard(user_id)
+        await super().set_presence(user_id, online)
+        await self._announce_presence([user_id], online)
+
+    async def refresh_presence(self, user_ids: Iterable[int]):
+        await self._announce_presence(user_ids, True)
+
+
+def get_backplane() -> Optional[Backplane]:
+    """Build the backplane selected by CHAT_BACKPLANE; None keeps delivery process-local"""
+    if not CHAT_BACKPLANE:
+        return None
+    if CHAT_BACKPLANE == "memory":
+        return InMemoryBackplane()
+    if CHAT_BACKPLANE == "redis":
+        return RedisBackplane(CHAT_BACKPLANE_URL or "redis://localhost:6379/0")
+    if CHAT_BACKPLANE == "postgres":
+        return PostgresBackplane(CHAT_BACKPLANE_URL or os.environ.get("DATABASE_URL"))
+    raise RuntimeError(f"Unknown CHAT_BACKPLANE: {CHAT_BACKPLANE}")
@@ -1,81 +1,637 @@
-from typing import List, Optional
+import asyncio
+import json
+import os
+import time
+from typing import Iterable, List, Optional
+
+import msgpack
 from fastapi import WebSocket, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc
+from sqlalchemy import and_, or_, desc, tuple_, update
 from datetime import datetime
 
 from app.auth.models import User, UserRole
+from app.chat.backplane import Backplane, get_backplane
+from app.chat.presence import PRESENCE_TTL, Presence
+from app.chat.replay import EventLog
+from app.chat.archive import load_archived_messages, load_archived_messages_after
+from app.chat.attachments import attachment_ids_by_message, claim_attachments
+from app.chat.counters import bump_chat_counters, get_chat_counter, set_chat_counter
+from app.chat.events import queue_live_event
 from app.chat.models import Conversation, Message, Notification
 from app.chat.schemas import ConversationCreate, ConversationDetail, ConversationWithMessages, MessageResponse, NotificationResponse, ChatStats, MessageBase
 
 from app.property.models import UserProperty
 
 
+# Seconds a single socket may take to accept a frame before it is dropped
+SEND_TIMEOUT = float(os.environ.get("CHAT_SEND_TIMEOUT", 5))
+
+# Frames buffered per socket; what happens when a slow client fills it:
+# "close" ends the socket so it reconnects and replays, "drop" discards the oldest frame
+OUTBOUND_QUEUE_SIZE = int(os.environ.get("CHAT_OUTBOUND_QUEUE_SIZE", 256))
+SLOW_CONSUMER_POLICY = os.environ.get("CHAT_SLOW_CONSUMER_POLICY", "close")
+
+# The server pings every interval; sockets silent for the timeout are reaped
+HEARTBEAT_INTERVAL = float(os.environ.get("CHAT_HEARTBEAT_INTERVAL", 25))
+HEARTBEAT_TIMEOUT = float(os.environ.get("CHAT_HEARTBEAT_TIMEOUT", 75))
+
+# Oldest socket is closed past the per-user limit; new ones are refused past the worker limit
+MAX_CONNECTIONS_PER_USER = int(os.environ.get("CHAT_MAX_CONNECTIONS_PER_USER", 5))
+MAX_CONNECTIONS_PER_WORKER = int(os.environ.get("CHAT_MAX_CONNECTIONS_PER_WORKER", 10000))
+
+# Close code asking the client to retry later (RFC 6455 registry)
+WS_1013_TRY_AGAIN_LATER = 1013
+
+# Frames queued for one socket within this many seconds go out as one "batch" frame
+COALESCE_WINDOW = float(os.environ.get("CHAT_COALESCE_MS", 10)) / 1000
+MAX_BATCH_SIZE = 50
+# Replies and control frames skip the window, flushing whatever is queued ahead of them
+IMMEDIATE_FRAME_TYPES = {"ack", "read_ack", "error", "ping", "pong", "resync"}
+
+# WebSocket subprotocols a client may ask for
+JSON_SUBPROTOCOL = "json"
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+# Seconds to batch a user's notification pushes into one digest (0 = push each)
+DIGEST_WINDOW = float(os.environ.get("NOTIFICATION_DIGEST_SECONDS", 0))
+
+# Event types also forwarded to /notifications/stream subscribers
+STREAM_EVENT_TYPES = {"notification", "notification_digest", "counters", "visit"}
+STREAM_QUEUE_SIZE = 100
+
+# Event types that are not kept for replay after a reconnect
+EPHEMERAL_EVENT_TYPES: set[str] = {"typing"}
+
+
+class Connection:
+    """
+    One accepted socket with its own bounded outbound queue.
+    
+    A writer task drains the queue, so producers only enqueue and are
+    never held up by a slow client.
+    """
+    
+    def __init__(self, websocket: WebSocket, user_id: int, on_close, subprotocol: Optional[str] = None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+        self.flush = asyncio.Event()
+        self.last_seen = time.monotonic()
+        self.closed = False
+        # conversation id -> other participant, so typing frames skip the database
+        self.partners: dict[int, int] = {}
+        self._on_close = on_close
+        self.writer = asyncio.create_task(self._write())
+    
+    def send(self, message: dict):
+        """Queue a frame without waiting; applies the slow consumer policy when full"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if SLOW_CONSUMER_POLICY == "drop":
+                self.queue.get_nowait()
+                self.queue.put_nowait(message)
+            else:
+                self.close(WS_1013_TRY_AGAIN_LATER)
+                return
+        self._flush_if_immediate(message)
+    
+    async def send_wait(self, message: dict):
+        """Queue a frame, waiting for room (for the socket's own coroutine only)"""
+        if not self.closed:
+            await self.queue.put(message)
+            self._flush_if_immediate(message)
+    
+    def _flush_if_immediate(self, message: dict):
+        if message.get("type") in IMMEDIATE_FRAME_TYPES:
+            self.flush.set()
+    
+    def touch(self):
+        self.last_seen = time.monotonic()
+    
+    async def receive(self) -> dict:
+        """Next client frame, decoded with the negotiated subprotocol (ValueError if it isn't an object)"""
+        try:
+            if self.binary:
+                data = msgpack.unpackb(await self.websocket.receive_bytes())
+            else:
+                data = await self.websocket.receive_json()
+        except (KeyError, TypeError, ValueError) as e:
+            # Undecodable, or a text frame where binary was negotiated (or the reverse)
+            raise ValueError("Invalid frame") from e
+        if not isinstance(data, dict):
+            raise ValueError("Invalid frame")
+        return data
+    
+    async def _send_frame(self, message: dict):
+        if self.binary:
+            await self.websocket.send_bytes(msgpack.packb(message))
+        else:
+            await self.websocket.send_text(json.dumps(message, separators=(",", ":")))
+    
+    async def _write(self):
+        try:
+            while True:
+                messages = [await self.queue.get()]
+                if COALESCE_WINDOW and not self.flush.is_set():
+                    # Let a burst accumulate, then send it as one frame,
+                    # unless a reply is queued meanwhile
+                    try:
+                        await asyncio.wait_for(self.flush.wait(), COALESCE_WINDOW)
+                    except asyncio.TimeoutError:
+                        pass
+                while len(messages) < MAX_BATCH_SIZE and not self.queue.empty():
+                    messages.append(self.queue.get_nowait())
+                if self.queue.empty():
+                    self.flush.clear()
+                frame = messages[0] if len(messages) == 1 else {"type": "batch", "events": messages}
+                await asyncio.wait_for(self._send_frame(frame), SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Connection closed or too slow
+            self.close(status.WS_1011_INTERNAL_ERROR)
+    
+    def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        if self.closed:
+            return
+        self.closed = True
+        self._on_close(self)
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        asyncio.get_running_loop().create_task(self._close_socket(code))
+    
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[int, WebSocket] = {}
-    
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-    
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    def __init__(self, backplane: Optional[Backplane] = None):
+        # A user can have several tabs/devices open at once
+        self.active_connections: dict[int, list[Connection]] = {}
+        self.connection_count = 0
+        # Server-sent event subscribers (notification streams)
+        self.streams: dict[int, set[asyncio.Queue]] = {}
+        # Relays events to sockets held by other workers
+        self.backplane = backplane
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: set[asyncio.Task] = set()
+        # Notifications held back per user while digest mode batches them
+        self.digests: dict[int, list[dict]] = {}
+        # Per-user event ids and recent frames for reconnect replay
+        self.events = EventLog()
+        # Online/typing state (memory only, shared through the backplane)
+        self.presence = Presence()
+        self.heartbeat: Optional[asyncio.Task] = None
+    
+    async def start(self, backplane: Optional[Backplane] = None):
+        """Subscribe this worker to the backplane (called once at startup)"""
+        self.loop = asyncio.get_running_loop()
+        await self.events.start()
+        self.heartbeat = asyncio.create_task(self._run_heartbeat())
+        self.backplane = backplane or self.backplane or get_backplane()
+        # Other workers may serve this user's reconnect, so every event must reach the table
+        self.events.write_through = self.backplane is not None
+        if self.backplane:
+            await self.backplane.start(self._on_backplane_event)
+    
+    async def stop(self):
+        if self.heartbeat:
+            self.heartbeat.cancel()
+        if self.backplane:
+            await self.backplane.stop()
+        await self.events.stop()
+    
+    def _is_local(self, user_id: int) -> bool:
+        return user_id in self.active_connections or user_id in self.streams
+    
+    async def connect(self, websocket: WebSocket, user_id: int) -> Optional[Connection]:
+        """Accept a socket; returns None when this worker is at its connection limit"""
+        if self.connection_count >= MAX_CONNECTIONS_PER_WORKER:
+            await websocket.close(code=WS_1013_TRY_AGAIN_LATER)
+            return None
+        
+        # Compression (permessage-deflate) is negotiated by the server itself;
+        # here the client may opt into MessagePack instead of JSON text frames
+        requested = websocket.scope.get("subprotocols") or []
+        subprotocol = None
+        if MSGPACK_SUBPROTOCOL in requested:
+            subprotocol = MSGPACK_SUBPROTOCOL
+        elif JSON_SUBPROTOCOL in requested:
+            subprotocol = JSON_SUBPROTOCOL
+        await websocket.accept(subprotocol=subprotocol)
+        
+        was_local = self._is_local(user_id)
+        connections = self.active_connections.setdefault(user_id, [])
+        connection = Connection(websocket, user_id, self._forget, subprotocol)
+        connections.append(connection)
+        self.connection_count += 1
+        # Too many tabs/devices: the oldest socket makes room
+        while len(connections) > MAX_CONNECTIONS_PER_USER:
+            connections[0].close(status.WS_1008_POLICY_VIOLATION)
+        
+        if not was_local:
+            await self._came_online(user_id)
+        return connection
+    
+    async def replay(self, connection: Connection, since: int):
+        """Resend what the user missed after `since`, or ask the client to resync"""
+        frames = await self.events.replay(connection.user_id, since, include_stored=self.backplane is not None)
+        if frames is None:
+            await connection.send_wait({"type": "resync"})
+            return
+        for frame in frames:
+            await connection.send_wait(frame)
+    
+    def disconnect(self, connection: Connection):
+        connection.close()
+    
+    def _forget(self, connection: Connection):
+        connections = self.active_connections.get(connection.user_id)
+        if connections is None or connection not in connections:
+            return
+        connections.remove(connection)
+        self.connection_count -= 1
+        if not connections:
+            del self.active_connections[connection.user_id]
+            self._went_offline(connection.user_id)
+    
+    async def _run_heartbeat(self):
+        """Ping every socket, reap the ones that stopped answering and refresh presence"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            deadline = time.monotonic() - HEARTBEAT_TIMEOUT
+            for connections in list(self.active_connections.values()):
+                for connection in list(connections):
+                    if connection.last_seen < deadline:
+                        connection.close(status.WS_1001_GOING_AWAY)
+                    else:
+                        connection.send({"type": "ping"})
+            
+            self.presence.sweep()
+            local_users = set(self.active_connections) | set(self.streams)
+            if self.backplane and local_users:
+                # One batched refresh per worker keeps remote TTLs alive
+                try:
+                    await self._publish_presence(list(local_users), PRESENCE_TTL)
+                    await self.backplane.refresh_presence(local_users)
+                except Exception as e:
+                    print(f"Presence refresh failed: {str(e)}")
+    
+    def is_online(self, user_id: int) -> bool:
+        """Connected to this worker, or reported online by another one"""
+        return self._is_local(user_id) or self.presence.remote.alive(user_id)
+    
+    async def send_typing(self, conversation_id: int, user_id: int, recipient_id: int):
+        """Tell the other participant that the user is typing (throttled, never stored)"""
+        if not self.presence.should_send_typing(conversation_id, user_id):
+            return
+        await self.send_personal_message({
+            "type": "typing",
+            "conversation_id": conversation_id,
+            "user_id": user_id
+        }, recipient_id)
+    
+    async def _came_online(self, user_id: int):
+        if self.backplane:
+            await self.backplane.set_presence(user_id, True)
+            await self._publish_presence([user_id], PRESENCE_TTL)
+    
+    async def _publish_presence(self, user_ids: List[int], ttl: float):
+        await self.backplane.publish({"kind": "presence_ttl", "user_ids": user_ids, "ttl": ttl})
+    
+    async def subscribe_stream(self, user_id: int) -> asyncio.Queue:
+        """Register a notification stream; events arrive on the returned queue"""
+        was_local = self._is_local(user_id)
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.streams.setdefault(user_id, set()).add(queue)
+        if not was_local:
+            await self._came_online(user_id)
+        return queue
+    
+    def unsubscribe_stream(self, queue: asyncio.Queue, user_id: int):
+        queues = self.streams.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.streams[user_id]
+            self._went_offline(user_id)
+    
+    def _went_offline(self, user_id: int):
+        if self.backplane and not self._is_local(user_id):
+            loop = asyncio.get_running_loop()
+            loop.create_task(self.backplane.set_presence(user_id, False))
+            loop.create_task(self._publish_presence([user_id], 0))
     
     async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_json(message)
-            except:
-                # Connection closed
-                self.disconnect(user_id)
+        await self.send_to_users(message, [user_id])
+    
+    async def send_to_users(self, message: dict, user_ids: Iterable[int]):
+        """Send one message to every socket of every recipient, on any worker"""
+        user_ids = set(user_ids)
+        event_ids = self._stamp(message, user_ids)
+        await asyncio.gather(
+            self.deliver_local(message, user_ids, event_ids),
+            self._publish(message, user_ids, event_ids)
+        )
+    
+    def _stamp(self, message: dict, user_ids: set[int]) -> Optional[dict[int, int]]:
+        """Give the message an event id per recipient and log it for replay"""
+        if message.get("type") in EPHEMERAL_EVENT_TYPES:
+            return None
+        event_ids = {}
+        for user_id in user_ids:
+            event_ids[user_id] = self.events.next_id(user_id)
+            self.events.record(user_id, event_ids[user_id], {**message, "event_id": event_ids[user_id]})
+        return event_ids
+    
+    async def deliver_local(self, message: dict, user_ids: Iterable[int], event_ids: Optional[dict[int, int]] = None):
+        """Queue the frame on every socket and stream held by this worker"""
+        for user_id in set(user_ids):
+            frame = {**message, "event_id": event_ids[user_id]} if event_ids else message
+            if message.get("type") in STREAM_EVENT_TYPES:
+                for queue in list(self.streams.get(user_id, ())):
+                    self._enqueue_stream(queue, frame)
+            for connection in list(self.active_connections.get(user_id, ())):
+                connection.send(frame)
+    
+    async def _publish(self, message: dict, user_ids: set[int], event_ids: Optional[dict[int, int]] = None):
+        if not self.backplane:
+            return
+        remote_workers = await asyncio.gather(*(self.backplane.remote_workers(user_id) for user_id in user_ids))
+        remote_user_ids = [user_id for user_id, workers in zip(user_ids, remote_workers) if workers]
+        if remote_user_ids:
+            event = {"kind": "deliver", "user_ids": remote_user_ids, "message": message}
+            if event_ids:
+                # JSON object keys are strings
+                event["event_ids"] = {str(user_id): event_ids[user_id] for user_id in remote_user_ids}
+            await self.backplane.publish(event)
+    
+    def _enqueue_stream(self, queue: asyncio.Queue, message: dict):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Subscriber fell behind: end its stream so it resumes via Last-Event-ID
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+    
+    async def _on_backplane_event(self, event: dict):
+        if event.get("kind") == "presence_ttl":
+            self.presence.apply(event["user_ids"], event["ttl"])
+        elif event.get("kind") == "deliver":
+            event_ids = {int(user_id): event_id for user_id, event_id in (event.get("event_ids") or {}).items()}
+            for user_id, event_id in event_ids.items():
+                # Already persisted by the publishing worker; buffer it for local replays
+                self.events.record(user_id, event_id, {**event["message"], "event_id": event_id}, persist=False)
+            await self.deliver_local(event["message"], event["user_ids"], event_ids or None)
+    
+    def dispatch(self, message: dict, user_ids: Iterable[int]):
+        """
+        Schedule a send from synchronous code, e.g. after a transaction commits.
+        Safe to call from the event loop or from a threadpool worker.
+        """
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._schedule, message, list(user_ids))
+    
+    def _schedule(self, message: dict, user_ids: List[int]):
+        if DIGEST_WINDOW and message.get("type") == "notification":
+            for user_id in user_ids:
+                self._add_to_digest(user_id, message["data"])
+            return
+        task = self.loop.create_task(self.send_to_users(message, user_ids))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+    
+    def _add_to_digest(self, user_id: int, notification: dict):
+        pending = self.digests.setdefault(user_id, [])
+        if not pending:
+            self.loop.call_later(DIGEST_WINDOW, self._flush_digest, user_id)
+        pending.append(notification)
+    
+    def _flush_digest(self, user_id: int):
+        notifications = self.digests.pop(user_id, [])
+        if notifications:
+            self._schedule({"type": "notification_digest", "data": {"notifications": notifications}}, [user_id])
 
 
 manager = ConnectionManager()
 
 
 # Helper Functions
-def create_notification(db: Session, user_id: int, message: Message, conversation: Conversation) -> Notification:
-    """Create a notification for a new message"""
-    sender_name = f"{message.sender.first_name} {message.sender.last_name}"
+def create_notification(db: Session, user_id: int, message: Message, conversation: Conversation, sender: User) -> Notification:
+    """
+    Notify the recipient of a new message, in the caller's transaction.
+    
+    While an unread message notification for the conversation exists it is
+    updated in place (count, preview, latest message) rather than adding a
+    row, so a burst of messages yields one notification and one push.
+    """
+    sender_name = f"{sender.first_name} {sender.last_name}"
+    preview = message.content[:100] + ("..." if len(message.content) > 100 else "")
+    
+    notification = db.query(Notification).filter(
+        Notification.user_id == user_id,
+        Notification.conversation_id == conversation.id,
+        Notification.notification_type == "message",
+        Notification.is_read == False
+    ).with_for_update().first()
+    
+    if notification:
+        # The row is locked, so the count can be bumped in Python
+        notification.count = (notification.count or 1) + 1
+        notification.message_id = message.id
+        notification.title = f"{notification.count} new messages from {sender_name}"
+        notification.body = preview
+        notification.created_at = datetime.utcnow()
+        return notification
     
     notification = Notification(
         user_id=user_id,
         message_id=message.id,
         conversation_id=conversation.id,
         title=f"New message from {sender_name}",
-        body=message.content[:100] + ("..." if len(message.content) > 100 else "")
+        body=preview,
+        count=1
     )
     db.add(notification)
-    db.commit()
-    db.refresh(notification)
+    bump_chat_counters(db, user_id, unread_notifications=1)
     return notification
 
 
-async def send_notification(user_id: int, notification_data: dict):
-    """Send notification through WebSocket if user is connected"""
-    await manager.send_personal_message({
-        "type": "notification",
-        "data": notification_data
-    }, user_id)
+def queue_read_receipt(db: Session, user_id: int, conversation_id: int, message_ids: List[int]):
+    """Push a read receipt to the sender once the transaction commits"""
+    queue_live_event(db, [user_id], {
+        "type": "read_receipt",
+        "conversation_id": conversation_id,
+        "message_ids": message_ids
+    })
 
 
-async def send_message(user_id: int, message_data: dict):
-    """Send message through WebSocket"""
-    await manager.send_personal_message({
+def queue_new_message(db: Session, message: MessageResponse, recipient_id: int):
+    """Push the message itself to the recipient once the transaction commits"""
+    queue_live_event(db, [recipient_id], {
         "type": "message",
-        "data": message_data
-    }, user_id)
+        "data": {
+            "id": message.id,
+            "conversation_id": message.conversation_id,
+            "sender_id": message.sender_id,
+            "sender_name": message.sender_name,
+            "content": message.content,
+            "attachment_ids": message.attachment_ids,
+            "created_at": message.created_at.isoformat()
+        }
+    })
 
 
-async def send_read_receipt(user_id: int, conversation_id: int, message_ids: List[int]):
-    """Send read receipt through WebSocket"""
-    await manager.send_personal_message({
-        "type": "read_receipt",
-        "conversation_id": conversation_id,
-        "message_ids": message_ids
-    }, user_id)
+def get_user_conversation(db: Session, conversation_id: int, current_user: User) -> Conversation:
+    """Get a conversation the current user takes part in"""
+    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    
+    if not conversation:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversation not found"
+        )
+    
+    if conversation.buyer_id != current_user.id and conversation.agent_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You don't have access to this conversation"
+        )
+    
+    return conversation
+
+
+def mark_conversation_read(
+    db: Session,
+    conversation: Conversation,
+    current_user: User
+) -> tuple[Optional[int], Optional[List[int]]]:
+    """
+    Mark the other participant's messages as read; returns receipt recipient and ids.
+    
+    One set-based UPDATE flips the messages and a second clears the matching
+    message notifications, both committed together; the receipt is pushed
+    after the commit.
+    """
+    now = datetime.utcnow()
+    message_ids = db.execute(
+        update(Message)
+        .where(
+            Message.conversation_id == conversation.id,
+            Message.sender_id != current_user.id,
+            Message.is_read == False
+        )
+        .values(is_read=True, read_at=now)
+        .returning(Message.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    
+    counter = unread_counter_name(conversation, current_user.id)
+    
+    if not message_ids:
+        if getattr(conversation, counter):
+            setattr(conversation, counter, 0)
+            db.commit()
+        return None, None
+    
+    cleared = db.execute(
+        update(Notification)
+        .where(
+            Notification.user_id == current_user.id,
+            Notification.conversation_id == conversation.id,
+            Notification.notification_type == "message",
+            Notification.is_read == False
+        )
+        .values(is_read=True, read_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    setattr(conversation, counter, 0)
+    bump_chat_counters(
+        db, current_user.id,
+        unread_messages=-len(message_ids),
+        unread_notifications=-cleared.rowcount
+    )
+    other_user_id = conversation.agent_id if conversation.buyer_id == current_user.id else conversation.buyer_id
+    message_ids = sorted(message_ids)
+    queue_read_receipt(db, other_user_id, conversation.id, message_ids)
+    db.commit()
+    
+    return other_user_id, message_ids
+
+
+def unread_counter_name(conversation: Conversation, user_id: int) -> str:
+    """Name of the unread counter column belonging to this participant"""
+    return "buyer_unread_count" if conversation.buyer_id == user_id else "agent_unread_count"
+
+
+def fill_conversation_read_model(conversation: Conversation, property_obj: UserProperty, buyer: User, agent: User):
+    """Copy the property and participant fields the inbox displays onto the conversation"""
+    conversation.property_title = property_obj.title
+    conversation.property_price = property_obj.price
+    conversation.property_city = property_obj.city
+    conversation.buyer_name = f"{buyer.first_name} {buyer.last_name}"
+    conversation.buyer_email = buyer.email
+    conversation.agent_name = f"{agent.first_name} {agent.last_name}"
+    conversation.agent_email = agent.email
+
+
+def backfill_conversation_read_model(db: Session) -> int:
+    """Populate the inbox columns for conversations created before they existed"""
+    conversations = db.query(Conversation).filter(Conversation.property_title == None).all()
+    
+    for conv in conversations:
+        fill_conversation_read_model(conv, conv.property, conv.buyer, conv.agent)
+        for participant_id in (conv.buyer_id, conv.agent_id):
+            unread_count = db.query(Message).filter(
+                and_(
+                    Message.conversation_id == conv.id,
+                    Message.sender_id != participant_id,
+                    Message.is_read == False
+                )
+            ).count()
+            setattr(conv, unread_counter_name(conv, participant_id), unread_count)
+    
+    if conversations:
+        db.commit()
+    return len(conversations)
+
+
+def build_conversation_detail(conversation: Conversation, current_user: User, schema=ConversationDetail, **extra):
+    """Build the API view of a conversation from its read-model columns only"""
+    is_buyer = conversation.buyer_id == current_user.id
+    
+    return schema(
+        id=conversation.id,
+        property_id=conversation.property_id,
+        buyer_id=conversation.buyer_id,
+        agent_id=conversation.agent_id,
+        last_message_at=conversation.last_message_at,
+        last_message_preview=conversation.last_message_preview,
+        is_active=conversation.is_active,
+        created_at=conversation.created_at,
+        property_title=conversation.property_title,
+        property_price=conversation.property_price,
+        property_city=conversation.property_city,
+        other_user_id=conversation.agent_id if is_buyer else conversation.buyer_id,
+        other_user_name=conversation.agent_name if is_buyer else conversation.buyer_name,
+        other_user_email=conversation.agent_email if is_buyer else conversation.buyer_email,
+        other_user_role=UserRole.AGENT.value if is_buyer else UserRole.BUYER.value,
+        unread_count=getattr(conversation, unread_counter_name(conversation, current_user.id)) or 0,
+        other_user_online=manager.is_online(conversation.agent_id if is_buyer else conversation.buyer_id),
+        **extra
+    )
 
 
 def create_new_conversation(
@@ -111,36 +667,29 @@ def create_new_conversation(
             detail="Conversation already exists for this property"
         )
     
-    # Create conversation
+    # Create conversation; the agent has the opening message unread
     conversation = Conversation(
         property_id=request.property_id,
         buyer_id=current_user.id,
         agent_id=property_obj.agent_id,
-        last_message_preview=request.message[:200]
+        last_message_preview=request.message[:200],
+        buyer_unread_count=0,
+        agent_unread_count=1
     )
+    fill_conversation_read_model(conversation, property_obj, current_user, property_obj.agent)
+    message = Message(sender_id=current_user.id, content=request.message)
+    conversation.messages.append(message)
     db.add(conversation)
-    db.commit()
-    db.refresh(conversation)
+    bump_chat_counters(db, current_user.id, total_conversations=1)
+    bump_chat_counters(db, property_obj.agent_id, total_conversations=1, unread_messages=1)
+    # One flush assigns both ids; everything below commits together
+    db.flush()
     
-    message = Message(
-        conversation_id=conversation.id,
-        sender_id=current_user.id,
-        content=request.message
-    )
-    db.add(message)
+    create_notification(db, property_obj.agent_id, message, conversation, current_user)
+    conversation_detail = build_conversation_detail(conversation, current_user)
     db.commit()
-    db.refresh(message)
     
-    return ConversationDetail(
-        **conversation.__dict__,
-        property_title=property_obj.title,
-        property_price=property_obj.price,
-        property_city=property_obj.city,
-        other_user_id=property_obj.agent_id,
-        other_user_name=f"{property_obj.agent.first_name} {property_obj.agent.last_name}",
-        other_user_email=property_obj.agent.email,
-        unread_count=0
-    ), message, property_obj.agent_id, conversation
+    return conversation_detail
 
 
 def get_user_conversations(
@@ -149,6 +698,7 @@ def get_user_conversations(
     skip: int = 0,
     limit: int = 20
 ) -> List[ConversationDetail]:
+    """Inbox: one indexed query over the conversation read model"""
     
     conversations = db.query(Conversation).filter(
         or_(
@@ -157,77 +707,75 @@ def get_user_conversations(
         )
     ).order_by(desc(Conversation.last_message_at)).offset(skip).limit(limit).all()
     
-    result = []
-    for conv in conversations:
-        is_buyer = conv.buyer_id == current_user.id
-        other_user = conv.agent if is_buyer else conv.buyer
-        
-        # Count unread messages
-        unread_count = db.query(Message).filter(
-            and_(
-                Message.conversation_id == conv.id,
-                Message.sender_id != current_user.id,
-                Message.is_read == False
-            )
-        ).count()
-        
-        result.append(ConversationDetail(
-            **conv.__dict__,
-            property_title=conv.property.title,
-            property_price=conv.property.price,
-            property_city=conv.property.city,
-            other_user_id=other_user.id,
-            other_user_name=f"{other_user.first_name} {other_user.last_name}",
-            other_user_email=other_user.email,
-            other_user_role=other_user.role,
-            unread_count=unread_count
-        ))
-    
-    return result
+    return [build_conversation_detail(conv, current_user) for conv in conversations]
 
 
 def get_conversation_with_messages(
     db: Session,
     conversation_id: int,
     current_user: User,
-    message_limit: int = 50
+    message_limit: int = 50,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None
 ) -> tuple[ConversationWithMessages, Optional[int], Optional[List[int]]]:
-    """Get conversation details with messages"""
-    
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-    
-    if not conversation:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Conversation not found"
-        )
-    
-    if conversation.buyer_id != current_user.id and conversation.agent_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You don't have access to this conversation"
-        )
-    
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(desc(Message.created_at)).limit(message_limit).all()
-    # Show oldest first
-    messages.reverse() 
-    
-    # Mark messages as read
-    unread_messages = [msg for msg in messages if msg.sender_id != current_user.id and not msg.is_read]
-    for msg in unread_messages:
-        msg.is_read = True
-        msg.read_at = datetime.utcnow()
-    
-    other_user_id = None
-    message_ids = None
-    
-    if unread_messages:
-        db.commit()
-        # Prepare data for read receipt
-        other_user_id = conversation.agent_id if conversation.buyer_id == current_user.id else conversation.buyer_id
-        message_ids = [msg.id for msg in unread_messages]
+    """
+    Get conversation details with a page of messages.
+    
+    Without a cursor the latest messages are returned. before_id pages back
+    through older history and after_id fetches newer messages; both are range
+    scans on idx_conversation_created ordered by (created_at, id). Paging back
+    past the hot table continues into the conversation's archive segments;
+    an after_id that has been archived since continues from the archive into
+    the hot table. Conversations with nothing archived never read segments.
+    """
+    
+    conversation = get_user_conversation(db, conversation_id, current_user)
+    
+    # Mark messages as read (not needed when scrolling back through history)
+    other_user_id, message_ids = None, None
+    if before_id is None:
+        other_user_id, message_ids = mark_conversation_read(db, conversation, current_user)
+    
+    query = db.query(Message).filter(Message.conversation_id == conversation_id)
+    position = tuple_(Message.created_at, Message.id)
+    archived_through = conversation.archived_through
+    
+    messages: List[Message] = []
+    if after_id is not None and archived_through is not None and after_id <= archived_through:
+        # The cursor was archived: newer archived messages come first, then
+        # the hot table from its start (every hot message is newer)
+        messages = load_archived_messages_after(db, conversation_id, after_id, message_limit + 1)
+        query = query.order_by(Message.created_at, Message.id)
+    elif after_id is not None:
+        anchor = db.query(Message.created_at).filter(Message.id == after_id).scalar_subquery()
+        query = query.filter(position > tuple_(anchor, after_id)).order_by(Message.created_at, Message.id)
+    else:
+        if before_id is not None:
+            anchor = db.query(Message.created_at).filter(Message.id == before_id).scalar_subquery()
+            query = query.filter(position < tuple_(anchor, before_id))
+        query = query.order_by(desc(Message.created_at), desc(Message.id))
+    
+    # Fetch one extra row to know whether another page exists
+    if len(messages) <= message_limit:
+        messages += query.limit(message_limit + 1 - len(messages)).all()
+    if after_id is None and archived_through is not None and len(messages) <= message_limit:
+        # Hot rows ran out; older history lives in the archive
+        oldest_id = messages[-1].id if messages else before_id
+        messages += load_archived_messages(db, conversation_id, oldest_id, message_limit + 1 - len(messages))
+    has_more = len(messages) > message_limit
+    messages = messages[:message_limit]
+    if after_id is None:
+        # Show oldest first
+        messages.reverse()
+    
+    # Only two participants, so resolve sender names once from the read model
+    sender_names = {
+        conversation.buyer_id: conversation.buyer_name,
+        conversation.agent_id: conversation.agent_name
+    }
+    
+    # Attachments travel as ids only; clients load the details lazily
+    attachment_ids = attachment_ids_by_message(db, [msg.id for msg in messages])
     
     # Format messages
     message_responses = []
@@ -237,34 +785,15 @@ def get_conversation_with_messages(
             conversation_id=msg.conversation_id,
             sender_id=msg.sender_id,
             content=msg.content,
+            attachment_ids=attachment_ids.get(msg.id, []),
             is_read=msg.is_read,
             read_at=msg.read_at,
             created_at=msg.created_at,
-            sender_name=f"{msg.sender.first_name} {msg.sender.last_name}"
+            sender_name=sender_names.get(msg.sender_id)
         ))
     
-    # Determine the other user
-    is_buyer = conversation.buyer_id == current_user.id
-    other_user = conversation.agent if is_buyer else conversation.buyer
-    
-    conversation_with_messages = ConversationWithMessages(
-        id=conversation.id,
-        property_id=conversation.property_id,
-        buyer_id=conversation.buyer_id,
-        agent_id=conversation.agent_id,
-        last_message_at=conversation.last_message_at,
-        last_message_preview=conversation.last_message_preview,
-        is_active=conversation.is_active,
-        created_at=conversation.created_at,
-        property_title=conversation.property.title,
-        property_price=conversation.property.price,
-        property_city=conversation.property.city,
-        other_user_id=other_user.id,
-        other_user_name=f"{other_user.first_name} {other_user.last_name}",
-        other_user_email=other_user.email,
-        other_user_role=other_user.role,
-        unread_count=0,
-        messages=message_responses
+    conversation_with_messages = build_conversation_detail(
+        conversation, current_user, ConversationWithMessages, messages=message_responses, has_more=has_more
     )
     
     return conversation_with_messages, other_user_id, message_ids
@@ -275,22 +804,16 @@ def create_message(
     conversation_id: int,
     request: MessageBase,
     current_user: User
-) -> tuple[MessageResponse, int, Message, Conversation]:
-    """Create a new message in a conversation"""
+) -> tuple[MessageResponse, int]:
+    """
+    Create a new message in a conversation.
     
-    conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
+    The message, the conversation's read model, the counters and the
+    recipient's notification commit as one unit; the live pushes go out
+    only after that commit.
+    """
     
-    if not conversation:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Conversation not found"
-        )
-    
-    if conversation.buyer_id != current_user.id and conversation.agent_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You don't have access to this conversation"
-        )
+    conversation = get_user_conversation(db, conversation_id, current_user)
     
     # Create message
     message = Message(
@@ -300,22 +823,34 @@ def create_message(
     )
     db.add(message)
     
-    # Update conversation
-    conversation.last_message_at = datetime.utcnow()
-    conversation.last_message_preview = request.content[:200]
-    
-    db.commit()
-    db.refresh(message)
-    
     # Determine recipient
     recipient_id = conversation.agent_id if conversation.buyer_id == current_user.id else conversation.buyer_id
     
+    # Update conversation; the counter increments in SQL so concurrent sends don't race
+    conversation.last_message_at = datetime.utcnow()
+    conversation.last_message_preview = request.content[:200]
+    counter = unread_counter_name(conversation, recipient_id)
+    setattr(conversation, counter, getattr(Conversation, counter) + 1)
+    bump_chat_counters(db, recipient_id, unread_messages=1)
+    db.flush()
+    claim_attachments(db, message, request.attachment_ids, current_user)
+    
     message_response = MessageResponse(
-        **message.__dict__,
+        id=message.id,
+        conversation_id=message.conversation_id,
+        sender_id=message.sender_id,
+        content=message.content,
+        attachment_ids=sorted(set(request.attachment_ids)),
+        is_read=False,
+        read_at=None,
+        created_at=message.created_at,
         sender_name=f"{current_user.first_name} {current_user.last_name}"
     )
+    create_notification(db, recipient_id, message, conversation, current_user)
+    queue_new_message(db, message_response, recipient_id)
+    db.commit()
     
-    return message_response, recipient_id, message, conversation
+    return message_response, recipient_id
 
 
 def get_user_notifications(
@@ -357,8 +892,10 @@ def mark_notification_read(
             detail="Notification not found"
         )
     
-    notification.is_read = True
-    notification.read_at = datetime.utcnow()
+    if not notification.is_read:
+        notification.is_read = True
+        notification.read_at = datetime.utcnow()
+        bump_chat_counters(db, current_user.id, unread_notifications=-1)
     
     db.commit()
     db.refresh(notification)
@@ -378,6 +915,7 @@ def mark_all_notifications_read(db: Session, current_user: User) -> dict:
         "is_read": True,
         "read_at": datetime.utcnow()
     })
+    set_chat_counter(db, current_user.id, "unread_notifications", 0)
     
     db.commit()
     
@@ -385,40 +923,12 @@ def mark_all_notifications_read(db: Session, current_user: User) -> dict:
 
 
 def get_user_chat_stats(db: Session, current_user: User) -> ChatStats:
-    """Get chat statistics for the current user"""
+    """Get chat statistics for the current user (one counter row, no counting)"""
     
-    total_conversations = db.query(Conversation).filter(
-        or_(
-            Conversation.buyer_id == current_user.id,
-            Conversation.agent_id == current_user.id
-        )
-    ).count()
-    
-    conversation_ids = db.query(Conversation.id).filter(
-        or_(
-            Conversation.buyer_id == current_user.id,
-            Conversation.agent_id == current_user.id
-        )
-    ).all()
-    conversation_ids = [c[0] for c in conversation_ids]
-    
-    unread_messages_count = db.query(Message).filter(
-        and_(
-            Message.conversation_id.in_(conversation_ids),
-            Message.sender_id != current_user.id,
-            Message.is_read == False
-        )
-    ).count() if conversation_ids else 0
-    
-    unread_notifications_count = db.query(Notification).filter(
-        and_(
-            Notification.user_id == current_user.id,
-            Notification.is_read == False
-        )
-    ).count()
+    counter = get_chat_counter(db, current_user.id)
     
     return ChatStats(
-        total_conversations=total_conversations,
-        unread_messages_count=unread_messages_count,
-        unread_notifications_count=unread_notifications_count
-    )
\ No newline at end of file
+        total_conversations=counter.total_conversations,
+        unread_messages_count=counter.unread_messages,
+        unread_notifications_count=counter.unread_notifications
+    )
@@ -0,0 +1,187 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, func, or_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.chat.events import queue_live_event
+from app.chat.models import ChatCounter, Conversation, Message, Notification
+
+
+# Seconds between full recounts that correct any drift in the counters
+RECONCILE_INTERVAL = float(os.environ.get("CHAT_COUNTER_RECONCILE_SECONDS", 600))
+
+COUNTER_FIELDS = ("unread_messages", "unread_notifications", "total_conversations")
+
+
+def bump_chat_counters(db: Session, user_id: int, **deltas: int):
+    """
+    Apply deltas to a user's counters inside the caller's transaction.
+
+    The arithmetic happens in SQL so concurrent writers never lose updates;
+    counters are clamped at zero. A missing row is seeded from a recount.
+    The deltas are pushed to the user's live streams after commit.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    values = {}
+    for field, delta in deltas.items():
+        column = getattr(ChatCounter, field)
+        values[field] = case((column + delta < 0, 0), else_=column + delta)
+    queue_live_event(db, [user_id], {"type": "counters", "data": {"delta": deltas}})
+
+    values["updated_at"] = datetime.utcnow()
+    result = db.execute(
+        update(ChatCounter)
+        .where(ChatCounter.user_id == user_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        # The recount already includes this transaction's writes; if another
+        # writer seeded the row first, the deltas go on top of theirs
+        _seed_chat_counter(db, user_id, values)
+
+
+def set_chat_counter(db: Session, user_id: int, field: str, value: int):
+    """Overwrite one counter (e.g. after marking everything read)"""
+    queue_live_event(db, [user_id], {"type": "counters", "data": {"totals": {field: value}}})
+    result = db.execute(
+        update(ChatCounter)
+        .where(ChatCounter.user_id == user_id)
+        .values({field: value, "updated_at": datetime.utcnow()})
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        _seed_chat_counter(db, user_id, {field: value, "updated_at": datetime.utcnow()}, {field: value})
+
+
+def _seed_chat_counter(db: Session, user_id: int, on_conflict: dict, overrides: Optional[dict] = None):
+    """
+    Create a missing counter row from a recount, in one upsert.
+
+    Two first writes for the same user can both find no row; whichever
+    inserts second applies `on_conflict` to the row instead of failing.
+    """
+    # Flush first so the recount already sees this transaction's writes
+    db.flush()
+    seed = {**count_chat_counters(db, user_id), **(overrides or {})}
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    db.execute(
+        dialect.insert(ChatCounter)
+        .values(user_id=user_id, updated_at=datetime.utcnow(), **seed)
+        .on_conflict_do_update(index_elements=[ChatCounter.user_id], set_=on_conflict)
+    )
+
+
+def count_chat_counters(db: Session, user_id: int) -> dict:
+    """Recount one user's counters from the source tables"""
+    participant = or_(Conversation.buyer_id == user_id, Conversation.agent_id == user_id)
+
+    total_conversations = db.query(func.count(Conversation.id)).filter(participant).scalar()
+
+    unread_messages = db.query(func.count(Message.id)).join(
+        Conversation, Message.conversation_id == Conversation.id
+    ).filter(
+        participant,
+        Message.sender_id != user_id,
+        Message.is_read == False
+    ).scalar()
+
+    unread_notifications = db.query(func.count(Notification.id)).filter(
+        Notification.user_id == user_id,
+        Notification.is_read == False
+    ).scalar()
+
+    return {
+        "unread_messages": unread_messages or 0,
+        "unread_notifications": unread_notifications or 0,
+        "total_conversations": total_conversations or 0,
+    }
+
+
+def get_chat_counter(db: Session, user_id: int) -> ChatCounter:
+    """Read the counter row; without one yet, an unsaved recount (the first write creates the row)"""
+    counter = db.get(ChatCounter, user_id)
+    if counter is None:
+        counter = ChatCounter(user_id=user_id, **count_chat_counters(db, user_id))
+    return counter
+
+
+def reconcile_chat_counters(db: Session) -> int:
+    """
+    Correct counter rows that drifted from the source tables; returns rows corrected.
+
+    Grouped counts over all users find the rows that look wrong without
+    locking anything. Each of those is then locked and recounted in its own
+    short transaction, so an increment committed while the reconciler runs
+    is either already in the recount or waits for the lock and applies on
+    top; the reconciler never overwrites it.
+    """
+    totals = {}
+
+    def collect(field, rows):
+        for user_id, count in rows:
+            totals.setdefault(user_id, dict.fromkeys(COUNTER_FIELDS, 0))[field] += count
+
+    collect("total_conversations", db.query(Conversation.buyer_id, func.count(Conversation.id)).group_by(Conversation.buyer_id).all())
+    collect("total_conversations", db.query(Conversation.agent_id, func.count(Conversation.id)).group_by(Conversation.agent_id).all())
+
+    # The recipient of a message is whichever participant did not send it
+    recipient = case(
+        (Message.sender_id == Conversation.buyer_id, Conversation.agent_id),
+        else_=Conversation.buyer_id
+    )
+    collect("unread_messages", db.query(recipient, func.count(Message.id)).join(
+        Conversation, Message.conversation_id == Conversation.id
+    ).filter(Message.is_read == False).group_by(recipient).all())
+
+    collect("unread_notifications", db.query(Notification.user_id, func.count(Notification.id)).filter(
+        Notification.is_read == False
+    ).group_by(Notification.user_id).all())
+
+    zero = dict.fromkeys(COUNTER_FIELDS, 0)
+    drifted = [
+        row.user_id
+        for row in db.query(ChatCounter.user_id, *(getattr(ChatCounter, field) for field in COUNTER_FIELDS))
+        if any(getattr(row, field) != totals.get(row.user_id, zero)[field] for field in COUNTER_FIELDS)
+    ]
+    # End the read so each recount below starts from a fresh snapshot
+    db.rollback()
+
+    corrected = 0
+    for user_id in drifted:
+        counter = db.query(ChatCounter).filter(
+            ChatCounter.user_id == user_id
+        ).populate_existing().with_for_update().first()
+        if counter is None:
+            db.rollback()
+            continue
+        expected = count_chat_counters(db, user_id)
+        if any(getattr(counter, field) != expected[field] for field in COUNTER_FIELDS):
+            for field in COUNTER_FIELDS:
+                setattr(counter, field, expected[field])
+            queue_live_event(db, [user_id], {"type": "counters", "data": {"totals": expected}})
+            corrected += 1
+        db.commit()
+    return corrected
+
+async def run_counter_reconciler(session_factory, interval: Optional[float] = None):
+    """Background loop that periodically reconciles the counters off the event loop"""
+    def reconcile():
+        with session_factory() as db:
+            return reconcile_chat_counters(db)
+
+    while True:
+        await asyncio.sleep(interval or RECONCILE_INTERVAL)
+        try:
+            corrected = await run_in_threadpool(reconcile)
+            if corrected:
+                print(f"Chat counters reconciled: {corrected} corrected")
+        except Exception as e:
+            print(f"Chat counter reconcile failed: {str(e)}")
@@ -0,0 +1,56 @@
+from typing import Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.chat.models import Notification
+
+
+# Session.info key holding live events waiting for the transaction to commit
+PENDING_EVENTS = "live_events"
+
+
+def queue_live_event(db: Session, user_ids: Iterable[int], message: dict):
+    """Deliver a WebSocket/stream event once the session's transaction commits"""
+    db.info.setdefault(PENDING_EVENTS, []).append((list(user_ids), message))
+
+
+def notification_payload(notification: Notification) -> dict:
+    return {
+        "id": notification.id,
+        "notification_type": notification.notification_type,
+        "related_id": notification.related_id,
+        "title": notification.title,
+        "body": notification.body,
+        "count": notification.count or 1,
+        "conversation_id": notification.conversation_id,
+        "is_read": bool(notification.is_read),
+        "created_at": notification.created_at.isoformat() if notification.created_at else None
+    }
+
+
+@event.listens_for(Session, "after_flush")
+def _queue_new_notifications(session: Session, flush_context):
+    # Every inserted notification is pushed, whichever module created it
+    for obj in session.new:
+        if isinstance(obj, Notification):
+            queue_live_event(session, [obj.user_id], {
+                "type": "notification",
+                "data": notification_payload(obj)
+            })
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_live_events(session: Session):
+    pending = session.info.pop(PENDING_EVENTS, None)
+    if not pending:
+        return
+    from app.chat.chat import manager
+
+    for user_ids, message in pending:
+        manager.dispatch(message, user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_live_events(session: Session):
+    session.info.pop(PENDING_EVENTS, None)
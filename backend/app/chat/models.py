@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index
+from sqlalchemy import BigInteger, Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index, Float, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -17,16 +17,36 @@ class Conversation(Base):
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Inbox read model: per-participant unread counters
+    buyer_unread_count = Column(Integer, default=0, nullable=False)
+    agent_unread_count = Column(Integer, default=0, nullable=False)
+    
+    # Denormalized so the inbox never joins properties/users
+    property_title = Column(String)
+    property_price = Column(Float)
+    property_city = Column(String)
+    buyer_name = Column(String)
+    buyer_email = Column(String)
+    agent_name = Column(String)
+    agent_email = Column(String)
+    
+    # Highest message id moved to archive segments (None: nothing archived)
+    archived_through = Column(Integer, nullable=True)
+    
     # Relationships
     property = relationship("UserProperty")
     buyer = relationship("User", foreign_keys=[buyer_id])
     agent = relationship("User", foreign_keys=[agent_id])
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+    attachments = relationship("MessageAttachment", cascade="all, delete-orphan")
     
     # For unique conversqation b/w a buyer and an agent
     __table_args__ = (
         Index('idx_buyer_property', 'buyer_id', 'property_id', unique=True),
         Index('idx_agent_buyer', 'agent_id', 'buyer_id'),
+        # Inbox ordering for each side of the conversation
+        Index('idx_buyer_last_message', 'buyer_id', 'last_message_at'),
+        Index('idx_agent_last_message', 'agent_id', 'last_message_at'),
     )
 
 
@@ -66,6 +86,8 @@ class Notification(Base):
     
     title = Column(String, nullable=False)
     body = Column(Text, nullable=False)
+    # Messages folded into this notification while it stayed unread
+    count = Column(Integer, default=1, nullable=False)
     
     is_read = Column(Boolean, default=False, index=True)
     read_at = Column(DateTime, nullable=True)
@@ -80,4 +102,82 @@ class Notification(Base):
     __table_args__ = (
         Index('idx_user_read', 'user_id', 'is_read'),
         Index('idx_user_created', 'user_id', 'created_at'),
-    )
\ No newline at end of file
+    )
+
+class ChatCounter(Base):
+    """Per-user badge counters so /chat/stats reads one row instead of counting"""
+    __tablename__ = "chat_counters"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    unread_messages = Column(Integer, default=0, nullable=False)
+    unread_notifications = Column(Integer, default=0, nullable=False)
+    total_conversations = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ChatEvent(Base):
+    """Live events kept for a while so reconnecting clients can replay what they missed"""
+    __tablename__ = "chat_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    event_id = Column(BigInteger, nullable=False)  # per-user, monotonically increasing
+    payload = Column(Text, nullable=False)  # JSON frame as sent
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        Index('idx_user_event', 'user_id', 'event_id', unique=True),
+    )
+
+
+class MessageAttachment(Base):
+    """File uploaded into a conversation; messages reference it by id only"""
+    __tablename__ = "message_attachments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.id", ondelete="CASCADE"), nullable=False)
+    uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Set when a message claims the attachment; no FK so archived messages keep theirs
+    message_id = Column(Integer, nullable=True, index=True)
+    
+    kind = Column(String, nullable=False)  # image, pdf
+    filename = Column(String)
+    content_type = Column(String)
+    size = Column(Integer)
+    url = Column(String, nullable=False)
+    public_id = Column(String, nullable=False)
+    
+    # Image preview
+    thumbnail_url = Column(String, nullable=True)
+    thumbnail_public_id = Column(String, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    # PDF preview
+    page_count = Column(Integer, nullable=True)
+    title = Column(String, nullable=True)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_attachment_conversation', 'conversation_id', 'uploader_id'),
+    )
+
+
+class ArchiveSegment(Base):
+    """Compressed NDJSON block of rows moved out of messages/notifications"""
+    __tablename__ = "archive_segments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # messages, notifications
+    owner_id = Column(Integer, nullable=False)  # conversation id for messages, user id for notifications
+    first_row_id = Column(Integer, nullable=False)
+    last_row_id = Column(Integer, nullable=False)
+    first_created_at = Column(DateTime, nullable=False)
+    last_created_at = Column(DateTime, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    payload = Column(LargeBinary, nullable=False)  # zlib-compressed, one JSON row per line
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_archive_owner_rows', 'kind', 'owner_id', 'last_row_id'),
+    )
@@ -0,0 +1,69 @@
+import os
+import time
+from typing import Dict, Hashable, Iterable
+
+
+# Seconds a remote "online" report stays valid without being refreshed
+PRESENCE_TTL = float(os.environ.get("CHAT_PRESENCE_TTL", 60))
+# Minimum seconds between two typing events for the same user and conversation
+TYPING_THROTTLE = float(os.environ.get("CHAT_TYPING_THROTTLE", 2))
+
+
+class TTLMap:
+    """In-memory set of keys that expire on their own; wall-clock based so workers agree"""
+
+    def __init__(self):
+        self._expires: Dict[Hashable, float] = {}
+
+    def set(self, key: Hashable, ttl: float):
+        self._expires[key] = time.time() + ttl
+
+    def discard(self, key: Hashable):
+        self._expires.pop(key, None)
+
+    def alive(self, key: Hashable) -> bool:
+        expires = self._expires.get(key)
+        if expires is None:
+            return False
+        if expires <= time.time():
+            del self._expires[key]
+            return False
+        return True
+
+    def sweep(self):
+        now = time.time()
+        for key in [key for key, expires in self._expires.items() if expires <= now]:
+            del self._expires[key]
+
+
+class Presence:
+    """
+    Online and typing state, kept only in memory.
+
+    Users connected to this worker are online by definition; users on other
+    workers are known from the backplane's periodic presence broadcasts,
+    which expire unless refreshed.
+    """
+
+    def __init__(self):
+        self.remote = TTLMap()
+        self.typing = TTLMap()
+
+    def apply(self, user_ids: Iterable[int], ttl: float):
+        for user_id in user_ids:
+            if ttl > 0:
+                self.remote.set(user_id, ttl)
+            else:
+                self.remote.discard(user_id)
+
+    def should_send_typing(self, conversation_id: int, user_id: int) -> bool:
+        """Throttle: True at most once per TYPING_THROTTLE for a user in a conversation"""
+        key = (conversation_id, user_id)
+        if self.typing.alive(key):
+            return False
+        self.typing.set(key, TYPING_THROTTLE)
+        return True
+
+    def sweep(self):
+        self.remote.sweep()
+        self.typing.sweep()
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.database import SessionLocal
+from app.chat.models import ChatEvent
+
+
+# Recent events kept in memory per user
+REPLAY_BUFFER_SIZE = int(os.environ.get("CHAT_REPLAY_BUFFER", 200))
+# How long events stay replayable from the database
+REPLAY_RETENTION = timedelta(hours=float(os.environ.get("CHAT_REPLAY_RETENTION_HOURS", 24)))
+# Seconds between batched writes to the database
+FLUSH_INTERVAL = float(os.environ.get("CHAT_REPLAY_FLUSH_SECONDS", 1))
+# Most events sent back on one reconnect; beyond that the client resyncs
+REPLAY_LIMIT = 500
+# Users with an in-memory buffer; the least recently active are dropped first
+MAX_BUFFERED_USERS = 10000
+# Rows kept for retry while the database is unavailable; past it the oldest are dropped
+MAX_UNFLUSHED = 50000
+# Low bits of every event id name the worker that stamped it, so ids from
+# different workers never collide; the rest is milliseconds (ids stay
+# below 2**53 so JavaScript clients can hold them)
+WORKER_BITS = 10
+
+
+class EventLog:
+    """
+    Per-user event ids plus a bounded ring buffer of recent frames.
+
+    Ids are millisecond timestamps bumped to stay strictly increasing per
+    user, so they also order events coming from other workers, with this
+    worker's random slot in the low WORKER_BITS.
+
+    On a single worker, events are written to chat_events (in batches) only
+    when they leave the ring buffer: pushed out by newer ones, dropped with
+    an idle user's buffer, or at shutdown. Buffer plus table always hold
+    the full history, so nothing is written for the common case of a user
+    who reconnects within a few hundred events.
+
+    With a backplane (write_through), a reconnect may land on a worker that
+    never saw the events, so every event the stamping worker records is
+    written: one chat_events row per recipient and event.
+    """
+
+    def __init__(self, buffer_size: int = REPLAY_BUFFER_SIZE, write_through: bool = False):
+        self.buffer_size = buffer_size
+        self.write_through = write_through
+        # Per user: (event id, frame, still to be written when it leaves the buffer)
+        self.buffers: "OrderedDict[int, deque]" = OrderedDict()
+        self.last_ids: Dict[int, int] = {}
+        self.unflushed: List[dict] = []
+        # Per user: newest event id dropped without being written; replays from before it resync
+        self.lost: Dict[int, int] = {}
+        self.worker = secrets.randbits(WORKER_BITS)
+        self.flusher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.flusher = asyncio.create_task(self._run_flusher())
+
+    async def stop(self):
+        if self.flusher:
+            self.flusher.cancel()
+        # Whatever is only in memory has to survive the restart
+        for user_id, buffer in self.buffers.items():
+            self._spill(user_id, buffer)
+        await self.flush()
+
+    def next_id(self, user_id: int) -> int:
+        millis = max((self.last_ids.get(user_id, 0) >> WORKER_BITS) + 1, time.time_ns() // 1_000_000)
+        event_id = millis << WORKER_BITS | self.worker
+        self.last_ids[user_id] = event_id
+        return event_id
+
+    def record(self, user_id: int, event_id: int, message: dict, persist: bool = True):
+        """Keep a stamped frame for replay (persist=False for frames logged by another worker)"""
+        if event_id > self.last_ids.get(user_id, 0):
+            self.last_ids[user_id] = event_id
+        buffer = self.buffers.get(user_id)
+        if buffer is None:
+            buffer = self.buffers[user_id] = deque(maxlen=self.buffer_size)
+            if len(self.buffers) > MAX_BUFFERED_USERS:
+                evicted, evicted_buffer = self.buffers.popitem(last=False)
+                self.last_ids.pop(evicted, None)
+                self._spill(evicted, evicted_buffer)
+        else:
+            self.buffers.move_to_end(user_id)
+            if len(buffer) == buffer.maxlen:
+                # The oldest frame is about to fall out of memory
+                self._spill(user_id, [buffer[0]])
+
+        if persist and self.write_through:
+            self._queue_write(user_id, event_id, message)
+            persist = False
+        buffer.append((event_id, message, persist))
+
+    def _spill(self, user_id: int, entries):
+        for event_id, message, pending in entries:
+            if pending:
+                self._queue_write(user_id, event_id, message)
+
+    def _queue_write(self, user_id: int, event_id: int, message: dict):
+        self.unflushed.append({
+            "user_id": user_id,
+            "event_id": event_id,
+            "payload": json.dumps(message),
+            "created_at": datetime.utcnow()
+        })
+
+    def is_expired(self, since: int) -> bool:
+        """True when events after `since` may already have been purged"""
+        return (since >> WORKER_BITS) / 1000 < (datetime.utcnow() - REPLAY_RETENTION - datetime(1970, 1, 1)).total_seconds()
+
+    async def replay(self, user_id: int, since: int, include_stored: bool = False) -> Optional[List[dict]]:
+        """
+        Frames for the user newer than `since`, oldest first.
+        Returns None when the gap can't be filled and the client must resync.
+        """
+        if self.is_expired(since) or since < self.lost.get(user_id, 0):
+            return None
+
+        buffer = self.buffers.get(user_id, ())
+        recent = {event_id: message for event_id, message, _ in buffer if event_id > since}
+        covered = bool(buffer) and buffer[0][0] <= since
+
+        if include_stored or not covered:
+            await self.flush()
+            stored = await run_in_threadpool(self._load, user_id, since)
+            for event_id, message in stored:
+                recent.setdefault(event_id, message)
+
+        if len(recent) > REPLAY_LIMIT:
+            return None
+        return [recent[event_id] for event_id in sorted(recent)]
+
+    def _load(self, user_id: int, since: int) -> list:
+        with SessionLocal() as db:
+            rows = db.query(ChatEvent.event_id, ChatEvent.payload).filter(
+                ChatEvent.user_id == user_id,
+                ChatEvent.event_id > since
+            ).order_by(ChatEvent.event_id).limit(REPLAY_LIMIT + 1).all()
+        return [(event_id, json.loads(payload)) for event_id, payload in rows]
+
+    async def flush(self):
+        if not self.unflushed:
+            return
+        rows, self.unflushed = self.unflushed, []
+        try:
+            await run_in_threadpool(self._write, rows)
+        except Exception as e:
+            # Retry with the next flush; what no longer fits makes its users resync
+            self.unflushed = rows + self.unflushed
+            overflow = len(self.unflushed) - MAX_UNFLUSHED
+            if overflow > 0:
+                for row in self.unflushed[:overflow]:
+                    self.lost[row["user_id"]] = max(self.lost.get(row["user_id"], 0), row["event_id"])
+                del self.unflushed[:overflow]
+            print(f"Event log flush failed, {len(self.unflushed)} events kept for retry: {str(e)}")
+
+    def _write(self, rows: list):
+        with SessionLocal() as db:
+            dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+            # A row already written (e.g. by a retried batch) must not fail the rest
+            db.execute(
+                dialect.insert(ChatEvent).on_conflict_do_nothing(index_elements=["user_id", "event_id"]),
+                rows
+            )
+            db.commit()
+
+    def _purge(self):
+        with SessionLocal() as db:
+            db.query(ChatEvent).filter(
+                ChatEvent.created_at < datetime.utcnow() - REPLAY_RETENTION
+            ).delete(synchronize_session=False)
+            db.commit()
+
+    async def _run_flusher(self):
+        last_purge = time.monotonic()
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+            if time.monotonic() - last_purge > 3600:
+                last_purge = time.monotonic()
+                self.lost = {user_id: event_id for user_id, event_id in self.lost.items() if not self.is_expired(event_id)}
+                try:
+                    await run_in_threadpool(self._purge)
+                except Exception as e:
+                    print(f"Event log purge failed: {str(e)}")
@@ -5,6 +5,8 @@ from typing import Optional, List
 
 class MessageBase(BaseModel):
     content: str = Field(..., min_length=1, max_length=5000)
+    # Uploaded attachment ids; details are fetched separately from /chat/attachments
+    attachment_ids: List[int] = Field(default_factory=list, max_length=10)
 
 
 class MessageCreate(MessageBase):
@@ -55,6 +57,7 @@ class ConversationDetail(ConversationBase):
     other_user_name: Optional[str] = None
     other_user_email: Optional[str] = None
     other_user_role: Optional[str] = None  # 'agent' or 'buyer'
+    other_user_online: bool = False
     
     # Unread count
     unread_count: int = 0
@@ -65,6 +68,8 @@ class ConversationDetail(ConversationBase):
 
 class ConversationWithMessages(ConversationDetail):
     messages: List[MessageResponse] = []
+    # More messages exist past this page (older, or newer when paging with after_id)
+    has_more: bool = False
     
     class Config:
         from_attributes = True
@@ -82,6 +87,7 @@ class NotificationResponse(NotificationBase):
     conversation_id: Optional[int] = None
     notification_type: str = "message"
     related_id: Optional[int] = None
+    count: int = 1
     is_read: bool
     read_at: Optional[datetime]
     created_at: datetime
@@ -103,4 +109,41 @@ class ChatStats(BaseModel):
 # WebSocket Message
 class WSMessage(BaseModel):
     type: str  # for 'message', 'notification', 'read_receipt', etc.
-    data: dict
\ No newline at end of file
+    data: dict
+
+class MessageSearchResult(BaseModel):
+    message_id: int
+    conversation_id: int
+    sender_id: int
+    created_at: datetime
+    # HTML-escaped excerpt with matches wrapped in <mark>
+    snippet: str
+    property_title: Optional[str] = None
+    other_user_name: Optional[str] = None
+
+
+class MessageSearchResponse(BaseModel):
+    results: List[MessageSearchResult] = []
+    # Pass as cursor to get the next (older) page; None on the last page
+    next_cursor: Optional[int] = None
+
+
+class AttachmentResponse(BaseModel):
+    id: int
+    conversation_id: int
+    uploader_id: int
+    message_id: Optional[int] = None
+    kind: str  # image, pdf
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    size: Optional[int] = None
+    url: str
+    thumbnail_url: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    page_count: Optional[int] = None
+    title: Optional[str] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
@@ -0,0 +1,193 @@
+import html
+from typing import List, Optional
+
+from sqlalchemy import func, literal_column, or_, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from app.auth.models import User
+from app.chat.models import Conversation, Message
+from app.chat.schemas import MessageSearchResponse, MessageSearchResult
+
+
+# Text search configuration used by the index and the queries (PostgreSQL)
+SEARCH_LANGUAGE = "english"
+# Private-use characters marking matches; swapped for <mark> after escaping
+MATCH_START = "\ue000"
+MATCH_END = "\ue001"
+# Words of context kept around a match in the snippet
+SNIPPET_WORDS = 12
+
+
+def ensure_search_index(engine: Engine):
+    """
+    Set up full-text search on messages.content at startup.
+
+    SQLite gets an external-content FTS5 table kept in sync by triggers,
+    filled from the existing rows the first time it is created.
+    PostgreSQL's GIN index can take a long time to build on a large table,
+    so startup only checks for it; build_search_index creates it.
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            valid = _search_index_valid(conn)
+        if not valid:
+            state = "invalid" if valid is False else "missing"
+            print(f"Message search index is {state}; searches scan messages "
+                  "until it is built with: python -m app.chat.search")
+        return
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+            )).first()
+            if exists:
+                return
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE messages_fts USING fts5("
+                "content, content='messages', content_rowid='id')"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+                "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+                "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+                "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+                "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END"
+            ))
+            conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+
+
+def _search_index_valid(conn) -> Optional[bool]:
+    """True if the PostgreSQL index is usable, False if a failed build left it invalid, None if missing"""
+    return conn.execute(text(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass('idx_message_content_fts')"
+    )).scalar()
+
+
+def build_search_index(engine: Engine):
+    """
+    Build the PostgreSQL GIN index over to_tsvector(content); run once per deploy.
+
+    CONCURRENTLY keeps writes flowing while a large table is indexed, but a
+    failed build leaves an invalid index behind that IF NOT EXISTS would
+    skip forever, so one is dropped and built again.
+    """
+    if engine.dialect.name != "postgresql":
+        print("Nothing to build: other databases set up search at startup")
+        return
+
+    # CONCURRENTLY can't run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        valid = _search_index_valid(conn)
+        if valid:
+            print("Message search index already built")
+            return
+        if valid is False:
+            print("Dropping invalid message search index")
+            conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS idx_message_content_fts"))
+
+        print("Building message search index...")
+        conn.execute(text(
+            "CREATE INDEX CONCURRENTLY idx_message_content_fts ON messages "
+            f"USING gin (to_tsvector('{SEARCH_LANGUAGE}', content))"
+        ))
+        print("Message search index built")
+
+
+def _fts5_query(q: str) -> str:
+    # Quote every term so user input can't use FTS5 operators; terms are ANDed
+    return " ".join('"' + term.replace('"', '""') + '"' for term in q.split())
+
+
+def _highlight(snippet: Optional[str]) -> str:
+    return html.escape(snippet or "").replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>")
+
+
+def _matching_messages(db: Session, q: str, user_id: int, limit: int, cursor: Optional[int]):
+    """(message id, snippet) for the newest matches in the user's conversations"""
+    if db.bind.dialect.name == "sqlite":
+        rows = db.execute(text(
+            "SELECT m.id, snippet(messages_fts, 0, :start, :end, '…', :words) "
+            "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+            "WHERE messages_fts MATCH :query "
+            "AND m.conversation_id IN ("
+            "SELECT id FROM conversations WHERE buyer_id = :user_id OR agent_id = :user_id) "
+            "AND (:cursor IS NULL OR m.id < :cursor) "
+            "ORDER BY m.id DESC LIMIT :limit"
+        ), {
+            "start": MATCH_START, "end": MATCH_END, "words": SNIPPET_WORDS,
+            "query": _fts5_query(q), "user_id": user_id, "cursor": cursor, "limit": limit
+        }).all()
+        return [(message_id, snippet) for message_id, snippet in rows]
+
+    # A literal (not a bind parameter) so the planner matches the expression index
+    language = literal_column(f"'{SEARCH_LANGUAGE}'::regconfig")
+    query = func.plainto_tsquery(language, q)
+    conversation_ids = db.query(Conversation.id).filter(
+        or_(Conversation.buyer_id == user_id, Conversation.agent_id == user_id)
+    )
+    # Page of matching ids first (served by the GIN index), headlines only for that page
+    page = db.query(Message.id).filter(
+        func.to_tsvector(language, Message.content).op("@@")(query),
+        Message.conversation_id.in_(conversation_ids)
+    )
+    if cursor is not None:
+        page = page.filter(Message.id < cursor)
+    page = page.order_by(Message.id.desc()).limit(limit).subquery()
+
+    headline = func.ts_headline(
+        language, Message.content, query,
+        f"StartSel={MATCH_START}, StopSel={MATCH_END}, MaxWords={SNIPPET_WORDS * 2}, MinWords={SNIPPET_WORDS // 2}"
+    )
+    return db.query(Message.id, headline).join(page, page.c.id == Message.id).order_by(Message.id.desc()).all()
+
+
+def search_messages(db: Session, current_user: User, q: str, limit: int = 20, cursor: Optional[int] = None) -> MessageSearchResponse:
+    """
+    Full-text search over the messages of the user's own conversations.
+
+    Newest matches come first; pass the returned next_cursor back as
+    cursor for the following page.
+    """
+    if not q.split():
+        return MessageSearchResponse()
+
+    matches = _matching_messages(db, q, current_user.id, limit + 1, cursor)
+    has_more = len(matches) > limit
+    matches = matches[:limit]
+
+    snippets = dict(matches)
+    rows = db.query(Message, Conversation).join(
+        Conversation, Conversation.id == Message.conversation_id
+    ).filter(Message.id.in_(list(snippets))).all() if snippets else []
+
+    results: List[MessageSearchResult] = []
+    for message, conversation in sorted(rows, key=lambda row: row[0].id, reverse=True):
+        is_buyer = conversation.buyer_id == current_user.id
+        results.append(MessageSearchResult(
+            message_id=message.id,
+            conversation_id=conversation.id,
+            sender_id=message.sender_id,
+            created_at=message.created_at,
+            snippet=_highlight(snippets[message.id]),
+            property_title=conversation.property_title,
+            other_user_name=conversation.agent_name if is_buyer else conversation.buyer_name
+        ))
+
+    return MessageSearchResponse(
+        results=results,
+        next_cursor=results[-1].message_id if has_more and results else None
+    )
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    build_search_index(engine)
@@ -17,4 +17,38 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def _async_database_url(url: str) -> str:
+    """The same database through its async driver (asyncpg / aiosqlite)"""
+    scheme, _, rest = url.partition("://")
+    if scheme in ("postgres", "postgresql", "postgresql+psycopg2"):
+        return f"postgresql+asyncpg://{rest}"
+    if scheme in ("sqlite", "sqlite+pysqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+
+# Override when the sync URL carries options the async driver doesn't accept
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or _async_database_url(SQLALCHEMY_DATABASE_URL)
+
+_async_session_factory = None
+
+
+def get_async_session_factory():
+    """Created on first use, so the async driver is only needed by async routes"""
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_pre_ping=True)
+        # Loaded attributes stay usable after commit; lazy loads aren't possible here
+        _async_session_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return _async_session_factory
+
+
+async def get_async_db():
+    """AsyncSession for async def routes, so DB I/O never blocks the event loop"""
+    async with get_async_session_factory()() as db:
+        yield db
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+
+# How often the loop is sampled for lag
+SAMPLE_INTERVAL = float(os.environ.get("LOOP_SAMPLE_MS", 100)) / 1000
+# Lag beyond this counts as a stall and dumps the blocking stack
+LAG_THRESHOLD = float(os.environ.get("LOOP_LAG_THRESHOLD_MS", 200)) / 1000
+# Opt-in: asyncio debug mode plus warnings for blocking calls made on the loop
+LOOP_DEBUG = os.environ.get("LOOP_DEBUG", "").lower() in ("1", "true", "yes")
+
+# Histogram bucket upper bounds, in milliseconds
+LAG_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Audit events that mean blocking I/O when they happen on the loop thread
+BLOCKING_EVENTS = {"open", "time.sleep", "socket.connect", "socket.getaddrinfo", "sqlite3.connect", "subprocess.Popen"}
+
+
+def _route_of(frame) -> Optional[str]:
+    """Find the ASGI scope of the request being handled in a stack"""
+    while frame is not None:
+        scope = frame.f_locals.get("scope")
+        if isinstance(scope, dict) and scope.get("type") in ("http", "websocket"):
+            route = scope.get("route")
+            path = getattr(route, "path", None) or scope.get("path")
+            return f"{scope.get('method', 'WS')} {path}"
+        frame = frame.f_back
+    return None
+
+
+class LoopMonitor:
+    """
+    Measures event loop lag and reports what blocked it.
+
+    A task on the loop wakes every SAMPLE_INTERVAL and records how late it
+    woke into a histogram. A watchdog thread watches the same heartbeat;
+    when the loop stays stuck past LAG_THRESHOLD it prints the loop
+    thread's current stack and the route being served, while the
+    blocking call is still running.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(LAG_BUCKETS) + 1)
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_tick = time.monotonic()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.sampler: Optional[asyncio.Task] = None
+        self.running = False
+        self.warned_sites = set()
+        self.in_audit = False
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self.running = True
+        self.sampler = asyncio.create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+        if LOOP_DEBUG:
+            self.loop.set_debug(True)
+            self.loop.slow_callback_duration = LAG_THRESHOLD
+            sys.addaudithook(self._audit)
+
+    async def stop(self):
+        self.running = False
+        if self.sampler:
+            self.sampler.cancel()
+
+    def record(self, lag: float):
+        lag_ms = lag * 1000
+        for index, bound in enumerate(LAG_BUCKETS):
+            if lag_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        self.samples += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+    def snapshot(self) -> dict:
+        """Histogram of observed lag (cumulative counts per bucket, like Prometheus)"""
+        cumulative, counts = 0, {}
+        for bound, count in zip(LAG_BUCKETS + ("+Inf",), self.buckets):
+            cumulative += count
+            counts[str(bound)] = cumulative
+        return {
+            "samples": self.samples,
+            "mean_ms": round(self.total_lag / self.samples * 1000, 3) if self.samples else 0.0,
+            "max_ms": round(self.max_lag * 1000, 3),
+            "stalls": self.stalls,
+            "threshold_ms": LAG_THRESHOLD * 1000,
+            "buckets_ms": counts
+        }
+
+    async def _sample(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            self.last_tick = time.monotonic()
+            self.record(max(0.0, self.last_tick - started - SAMPLE_INTERVAL))
+
+    def _watch(self):
+        reported_tick = None
+        while self.running:
+            time.sleep(SAMPLE_INTERVAL)
+            tick = self.last_tick
+            stalled = time.monotonic() - tick - SAMPLE_INTERVAL
+            if stalled < LAG_THRESHOLD or tick == reported_tick:
+                continue
+            # One report per stall, taken while the loop is still blocked
+            reported_tick = tick
+            self.stalls += 1
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            route = _route_of(frame) or "no request"
+            stack = "".join(traceback.format_stack(frame))
+            print(f"Event loop blocked for {stalled * 1000:.0f}ms so far ({route}):\n{stack}")
+
+    def _audit(self, event: str, args: tuple):
+        if event not in BLOCKING_EVENTS or self.in_audit or threading.get_ident() != self.loop_thread_id:
+            return
+        if event == "socket.connect" and args and getattr(args[0], "gettimeout", lambda: None)() == 0.0:
+            return  # non-blocking sockets are the loop's own business
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        frame = sys._getframe(1)
+        site = (event, frame.f_code.co_filename, frame.f_lineno)
+        if site in self.warned_sites:
+            return
+        self.warned_sites.add(site)
+        # Formatting the stack reads source files, which would re-enter the hook
+        self.in_audit = True
+        try:
+            route = _route_of(frame) or "no request"
+            stack = "".join(traceback.format_stack(frame))
+            print(f"Blocking call '{event}' on the event loop ({route}):\n{stack}")
+        finally:
+            self.in_audit = False
+
+
+monitor = LoopMonitor()
@@ -0,0 +1,65 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+
+# Columns added to tables that already existed. create_all only creates
+# missing tables, so databases from before these columns get them here.
+ADDED_COLUMNS = {
+    "conversations": {
+        "buyer_unread_count": "INTEGER NOT NULL DEFAULT 0",
+        "agent_unread_count": "INTEGER NOT NULL DEFAULT 0",
+        "property_title": "VARCHAR",
+        "property_price": "FLOAT",
+        "property_city": "VARCHAR",
+        "buyer_name": "VARCHAR",
+        "buyer_email": "VARCHAR",
+        "agent_name": "VARCHAR",
+        "agent_email": "VARCHAR",
+        "archived_through": "INTEGER",
+    },
+    "notifications": {
+        "count": "INTEGER NOT NULL DEFAULT 1",
+    },
+}
+
+# Run once, right after the column is added, to fill it in for existing rows
+BACKFILLS = {
+    ("conversations", "archived_through"): (
+        "UPDATE conversations SET archived_through = ("
+        "SELECT MAX(last_row_id) FROM archive_segments "
+        "WHERE kind = 'messages' AND owner_id = conversations.id)"
+    ),
+}
+
+# Indexes added to tables that already existed, for the same reason
+ADDED_INDEXES = {
+    "idx_buyer_last_message": "conversations (buyer_id, last_message_at)",
+    "idx_agent_last_message": "conversations (agent_id, last_message_at)",
+}
+
+
+def add_missing_columns(engine: Engine):
+    """
+    Bring tables created by an older version up to the current models.
+
+    Idempotent and cheap when nothing is missing, so it runs on every
+    start, right after create_all and before anything queries the new
+    columns.
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+
+    with engine.begin() as conn:
+        for table, columns in ADDED_COLUMNS.items():
+            if table not in tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, definition in columns.items():
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+                    print(f"Schema upgrade: added {table}.{name}")
+                    if (table, name) in BACKFILLS:
+                        conn.execute(text(BACKFILLS[(table, name)]))
+
+        for name, definition in ADDED_INDEXES.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}"))
@@ -3,23 +3,13 @@ from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
 from sqlalchemy import false
 from sqlalchemy.orm import Session
 from typing import List, Optional
-import cloudinary.uploader
-import cloudinary
-import os
 
 from app.auth.models import User
 from app.property.models import Favorite, PropertyImage, UserProperty
 from app.property.schemas import PropertyCreate
 from app.notifications import notify_admin_new_property, get_admin_emails
 from app.chat.models import Conversation
-
-
-
-cloudinary.config(
-    cloud_name = os.environ.get("CLOUDINARY_CLOUD_NAME"),
-    api_key = os.environ.get("CLOUDINARY_API_KEY"),
-    api_secret = os.environ.get("CLOUDINARY_API_SECRET")
-)
+from app.storage import get_storage
 
 
 def create_property(db: Session, request: PropertyCreate, agent_id: int):
@@ -86,7 +76,7 @@ def create_property(db: Session, request: PropertyCreate, agent_id: int):
 
 
 def upload_property_images(db: Session, property_id: int, files: List[UploadFile], agent_id: int):
-    """Upload images to Cloudinary and save URLs to database"""
+    """Upload images to the media storage and save URLs to database"""
     # Verify property exists and belongs to agent
     property = db.query(UserProperty).filter(UserProperty.id == property_id).first()
     if not property:
@@ -104,13 +94,14 @@ def upload_property_images(db: Session, property_id: int, files: List[UploadFile
     # Get agent info
     agent = db.query(User).filter(User.id == agent_id).first()
     
+    storage = get_storage()
     uploaded_images = []
     for index, file in enumerate(files):
         try:
-            # Upload to Cloudinary
-            result = cloudinary.uploader.upload(
+            result = storage.upload(
                 file.file,
-                folder=f"real_estate/media/properties/{property_id}"
+                folder=f"real_estate/media/properties/{property_id}",
+                filename=file.filename
             )
             
             # Save to database
@@ -257,6 +248,13 @@ def update_property(db: Session, property_id: int, request: PropertyCreate, agen
     for key, value in request.dict().items():
         setattr(property, key, value)
     
+    # Keep the chat inbox copies in sync
+    db.query(Conversation).filter(Conversation.property_id == property_id).update({
+        "property_title": property.title,
+        "property_price": property.price,
+        "property_city": property.city
+    })
+    
     db.commit()
     db.refresh(property)
     return property
@@ -283,11 +281,12 @@ def delete_property(db: Session, property_id: int, agent_id: int):
     for conversation in conversations:
         db.delete(conversation)
     
-    # Delete images from Cloudinary
+    # Delete images from media storage
+    storage = get_storage()
     for image in property.images:
         if image.public_id:
             try:
-                cloudinary.uploader.destroy(image.public_id)
+                storage.delete(image.public_id)
             except:
                 pass
     
@@ -116,4 +116,12 @@ class VisitRequestDisplay(BaseModel):
     agent_email: Optional[str] = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class VisitEvent(BaseModel):
+    """Live event pushed to both participants when a visit changes status"""
+    event: str  # visit_request, visit_confirmed, visit_reschedule, visit_declined, visit_completed
+    visit_id: int
+    status: str
+    visit: VisitRequestDisplay
@@ -6,9 +6,11 @@ from typing import List, Optional
 
 from app.property.models import VisitRequest, UserProperty, VisitStatus
 from app.auth.models import User
-from app.property.visit_schemas import VisitRequestCreate, VisitRequestResponse, VisitRequestDecline, VisitRequestComplete, VisitRequestDisplay
+from app.property.visit_schemas import VisitRequestCreate, VisitRequestResponse, VisitRequestDecline, VisitRequestComplete, VisitRequestDisplay, VisitEvent
 from app.auth.kyc import check_agent_eligibility, check_buyer_active_requests, update_agent_ranking, flag_buyer_for_abuse, check_buyer_no_shows
 from app.chat.models import Notification
+from app.chat.chat import manager
+from app.chat.counters import bump_chat_counters
 
 
 
@@ -104,9 +106,10 @@ def create_visit_request(db: Session, request: VisitRequestCreate, buyer_id: int
         body=f"{buyer_name} has requested to visit your property '{property_obj.title}' on {visit_request.preferred_date.strftime('%B %d, %Y')} at {visit_request.preferred_time_start}"
     )
     db.add(notification)
+    bump_chat_counters(db, notification.user_id, unread_notifications=1)
     db.commit()
     
-    return build_visit_display(db, visit_request)
+    return publish_visit_event("visit_request", build_visit_display(db, visit_request))
 
 
 def agent_respond_accept(db: Session, visit_id: int, agent_id: int):
@@ -141,9 +144,10 @@ def agent_respond_accept(db: Session, visit_id: int, agent_id: int):
         body=f"{agent_name} has confirmed your visit to '{property_obj.title}' on {visit.confirmed_date.strftime('%B %d, %Y')} at {visit.confirmed_time_start}"
     )
     db.add(notification)
+    bump_chat_counters(db, notification.user_id, unread_notifications=1)
     db.commit()
     
-    return build_visit_display(db, visit)
+    return publish_visit_event("visit_confirmed", build_visit_display(db, visit))
 
 
 def agent_propose_reschedule(
@@ -201,9 +205,10 @@ def agent_propose_reschedule(
         body=f"{agent_name} has proposed a new time for your visit to '{property_obj.title}': {visit.proposed_date.strftime('%B %d, %Y')} at {visit.proposed_time_start}"
     )
     db.add(notification)
+    bump_chat_counters(db, notification.user_id, unread_notifications=1)
     db.commit()
     
-    return build_visit_display(db, visit)
+    return publish_visit_event("visit_reschedule", build_visit_display(db, visit))
 
 
 def agent_decline(db: Session, visit_id: int, agent_id: int, decline: VisitRequestDecline):
@@ -241,9 +246,10 @@ def agent_decline(db: Session, visit_id: int, agent_id: int, decline: VisitReque
         body=f"{agent_name} has declined your visit request for '{property_obj.title}'. Reason: {decline.decline_reason or 'Not specified'}"
     )
     db.add(notification)
+    bump_chat_counters(db, notification.user_id, unread_notifications=1)
     db.commit()
     
-    return build_visit_display(db, visit)
+    return publish_visit_event("visit_declined", build_visit_display(db, visit))
 
 
 def buyer_confirm_proposal(db: Session, visit_id: int, buyer_id: int):
@@ -278,9 +284,10 @@ def buyer_confirm_proposal(db: Session, visit_id: int, buyer_id: int):
         body=f"{buyer_name} has confirmed the visit to '{property_obj.title}' on {visit.confirmed_date.strftime('%B %d, %Y')} at {visit.confirmed_time_start}"
     )
     db.add(notification)
+    bump_chat_counters(db, notification.user_id, unread_notifications=1)
     db.commit()
     
-    return build_visit_display(db, visit)
+    return publish_visit_event("visit_confirmed", build_visit_display(db, visit))
 
 
 def complete_visit(db: Session, visit_id: int, user_id: int, completion: VisitRequestComplete):
@@ -346,9 +353,10 @@ def complete_visit(db: Session, visit_id: int, user_id: int, completion: VisitRe
             body=f"Your visit to '{property_obj.title}' has been completed. Please take a moment to review your experience with {agent_name}."
         )
         db.add(notification)
+        bump_chat_counters(db, notification.user_id, unread_notifications=1)
         db.commit()
     
-    return build_visit_display(db, visit)
+    return publish_visit_event("visit_completed", build_visit_display(db, visit))
 
 
 # Add new function to mark buyer as interested
@@ -458,6 +466,13 @@ def get_visit_and_verify_buyer(db: Session, visit_id: int, buyer_id: int):
     return visit
 
 
+def publish_visit_event(event: str, display: VisitRequestDisplay) -> VisitRequestDisplay:
+    """Push a committed transition to the buyer's and agent's sockets and streams"""
+    payload = VisitEvent(event=event, visit_id=display.id, status=display.status, visit=display)
+    manager.dispatch({"type": "visit", "data": payload.model_dump(mode="json")}, [display.buyer_id, display.agent_id])
+    return display
+
+
 def build_visit_display(db: Session, visit: VisitRequest) -> VisitRequestDisplay:
     """Build a complete visit display with related data"""
     property_obj = visit.property
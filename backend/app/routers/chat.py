@@ -1,13 +1,18 @@
-from typing import List
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, Query, status
+import asyncio
+from typing import List, Optional
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, WebSocket, WebSocketDisconnect, Query, status
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
 
-from app.database import get_db
-from app.auth.oauth2 import get_current_user
+from app.database import get_db, SessionLocal
+from app.auth.oauth2 import get_current_user, get_user_from_token
 from app.auth.models import User
-from app.chat.schemas import ConversationCreate, ConversationDetail, ConversationWithMessages, MessageResponse, NotificationResponse, ChatStats, MessageBase
+from app.chat.schemas import ConversationCreate, ConversationDetail, ConversationWithMessages, MessageResponse, NotificationResponse, ChatStats, MessageBase, MessageSearchResponse, AttachmentResponse
 
-from app.chat.chat import manager, create_new_conversation, get_user_conversations, get_conversation_with_messages, create_message, get_user_notifications, mark_notification_read, mark_all_notifications_read, get_user_chat_stats, create_notification, send_notification, send_message, send_read_receipt
+from app.chat.chat import HEARTBEAT_TIMEOUT, manager, create_new_conversation, get_user_conversations, get_conversation_with_messages, create_message, get_user_notifications, mark_notification_read, mark_all_notifications_read, get_user_chat_stats, get_user_conversation, mark_conversation_read
+from app.chat.search import search_messages
+from app.chat.attachments import upload_attachment, get_attachments
 
 
 
@@ -18,25 +23,13 @@ router = APIRouter(
 
 
 @router.post("/conversations", response_model=ConversationDetail, status_code=status.HTTP_201_CREATED)
-async def create_conversation(
+def create_conversation(
     request: ConversationCreate,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Create a new conversation"""
-    conversation_detail, message, agent_id, conversation = create_new_conversation(db, request, current_user)
-    
-    # Create and send notification
-    notification = create_notification(db, agent_id, message, conversation)
-    await send_notification(agent_id, {
-        "id": notification.id,
-        "title": notification.title,
-        "body": notification.body,
-        "conversation_id": conversation_detail.id,
-        "created_at": notification.created_at.isoformat()
-    })
-    
-    return conversation_detail
+    """Create a new conversation (the agent's notification is pushed once committed)"""
+    return create_new_conversation(db, request, current_user)
 
 
 @router.get("/conversations", response_model=List[ConversationDetail])
@@ -50,61 +43,69 @@ def get_conversations(
     return get_user_conversations(db, current_user, skip, limit)
 
 
+@router.get("/search", response_model=MessageSearchResponse)
+def search_conversations(
+    q: str = Query(..., min_length=1, max_length=200),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    limit: int = Query(20, ge=1, le=50),
+    cursor: Optional[int] = Query(None, description="next_cursor from the previous page")
+):
+    """Search messages in the current user's conversations, newest first"""
+    return search_messages(db, current_user, q, limit, cursor)
+
+
 @router.get("/conversations/{conversation_id}", response_model=ConversationWithMessages)
-async def get_conversation_details(
+def get_conversation_details(
     conversation_id: int,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
-    message_limit: int = Query(50, ge=1, le=200)
+    message_limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = Query(None, description="Return messages older than this message id"),
+    after_id: Optional[int] = Query(None, description="Return messages newer than this message id")
 ):
-    """Get conversation details with messages"""
-    conversation_with_messages, other_user_id, message_ids = get_conversation_with_messages(
-        db, conversation_id, current_user, message_limit
+    """Get conversation details with a page of messages (read receipts are pushed on commit)"""
+    conversation_with_messages, _, _ = get_conversation_with_messages(
+        db, conversation_id, current_user, message_limit, before_id, after_id
     )
-    
-    # Send read receipts if there were unread messages
-    if other_user_id and message_ids:
-        await send_read_receipt(other_user_id, conversation_id, message_ids)
-    
     return conversation_with_messages
 
 
 @router.post("/conversations/{conversation_id}/messages", response_model=MessageResponse)
-async def send_new_message(
+def send_new_message(
     conversation_id: int,
     request: MessageBase,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Send a message in a conversation"""
-    message_response, recipient_id, message, conversation = create_message(
-        db, conversation_id, request, current_user
-    )
-    
-    # Create and send notification
-    notification = create_notification(db, recipient_id, message, conversation)
-    await send_notification(recipient_id, {
-        "id": notification.id,
-        "title": notification.title,
-        "body": notification.body,
-        "conversation_id": conversation.id,
-        "created_at": notification.created_at.isoformat()
-    })
-    
-    # Send message via WebSocket
-    await send_message(recipient_id, {
-        "id": message.id,
-        "conversation_id": conversation.id,
-        "sender_id": message.sender_id,
-        "sender_name": f"{current_user.first_name} {current_user.last_name}",
-        "content": message.content,
-        "created_at": message.created_at.isoformat()
-    })
-    
+    """Send a message in a conversation (the recipient's pushes go out once committed)"""
+    message_response, _ = create_message(db, conversation_id, request, current_user)
     return message_response
 
 
 
+@router.post("/conversations/{conversation_id}/attachments", response_model=AttachmentResponse, status_code=status.HTTP_201_CREATED)
+def upload_conversation_attachment(
+    conversation_id: int,
+    file: UploadFile = File(..., description="Image (JPEG, PNG, WebP, GIF) or PDF"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Upload an attachment; send it by listing its id in a message's attachment_ids"""
+    conversation = get_user_conversation(db, conversation_id, current_user)
+    return upload_attachment(db, conversation, current_user, file)
+
+
+@router.get("/attachments", response_model=List[AttachmentResponse])
+def get_message_attachments(
+    ids: List[int] = Query(..., max_length=50),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Details (URLs, thumbnails, PDF metadata) for attachment ids seen on messages"""
+    return get_attachments(db, ids, current_user)
+
+
 @router.patch("/notifications/all")
 def mark_all_notifications_as_read(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """Mark all notifications as read for the current user"""
@@ -142,19 +143,142 @@ def get_chat_stats(db: Session = Depends(get_db), current_user: User = Depends(g
     return get_user_chat_stats(db, current_user)
 
 
+# Sockets hold no database connection while idle: the handshake and every
+# frame use their own short-lived session
+
+def _ws_authenticate(token: str) -> Optional[User]:
+    with SessionLocal() as db:
+        try:
+            # Closing the session leaves the user detached with its attributes loaded
+            return get_user_from_token(token, db)
+        except HTTPException:
+            return None
+
+
+def _ws_send_message(current_user: User, data: dict):
+    request = MessageBase(content=data.get("content") or "", attachment_ids=data.get("attachment_ids") or [])
+    with SessionLocal() as db:
+        return create_message(db, int(data.get("conversation_id")), request, current_user)
+
+
+def _ws_conversation_partner(current_user: User, conversation_id: int) -> int:
+    with SessionLocal() as db:
+        conversation = get_user_conversation(db, conversation_id, current_user)
+        return conversation.agent_id if conversation.buyer_id == current_user.id else conversation.buyer_id
+
+
+def _ws_mark_read(current_user: User, data: dict):
+    with SessionLocal() as db:
+        conversation = get_user_conversation(db, int(data.get("conversation_id")), current_user)
+        return mark_conversation_read(db, conversation, current_user)
+
+
 @router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    user_id: int,
+    token: Optional[str] = Query(None),
+    since: Optional[int] = Query(None)
+):
     """
-    WebSocket connection for real-time chat
+    WebSocket connection for real-time chat.
+    
+    Authenticated once at handshake with ?token=<access token>. Server events
+    carry an "event_id"; reconnecting with ?since=<last event_id> replays the
+    events missed meanwhile, or sends {"type": "resync"} when that is no
+    longer possible. Client frames:
+    - {"type": "ping"} / {"type": "pong"} (answer to the server's own pings)
+    - {"type": "send_message", "temp_id": ..., "conversation_id": ..., "content": ..., "attachment_ids": [...]}
+      answered with {"type": "ack", "temp_id": ..., "data": <message>}
+    - {"type": "typing", "conversation_id": ...}
+      relayed (throttled) to the other participant as {"type": "typing", ...}
+    - {"type": "mark_read", "conversation_id": ...}
+      answered with {"type": "read_ack", "conversation_id": ..., "message_ids": [...]}
+    Failures, and frames that aren't a JSON/MessagePack object, are answered
+    with {"type": "error", "temp_id": ..., "detail": ...}.
+    Sockets that send nothing for CHAT_HEARTBEAT_TIMEOUT seconds are closed.
+    
+    Frames are JSON text, or MessagePack binary when the client asks for the
+    "msgpack" subprotocol. Server frames queued close together arrive as
+    {"type": "batch", "events": [...]}.
     """
-    await manager.connect(websocket, user_id)
+    current_user = await run_in_threadpool(_ws_authenticate, token) if token else None
+    
+    if current_user is None or current_user.id != user_id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    connection = await manager.connect(websocket, user_id)
+    if connection is None:
+        return
     
     try:
-        while True:
-            data = await websocket.receive_json()
+        if since is not None:
+            await manager.replay(connection, since)
+        
+        while not connection.closed:
+            try:
+                data = await asyncio.wait_for(connection.receive(), HEARTBEAT_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Missed every heartbeat: treat the socket as dead
+                break
+            except ValueError:
+                connection.touch()
+                connection.send({"type": "error", "detail": "Invalid frame"})
+                continue
+            connection.touch()
+            frame_type = data.get("type")
+            
+            if frame_type == "ping":
+                connection.send({"type": "pong"})
+            
+            elif frame_type == "send_message":
+                temp_id = data.get("temp_id")
+                try:
+                    message_response, recipient_id = await run_in_threadpool(
+                        _ws_send_message, current_user, data
+                    )
+                except (HTTPException, ValidationError, TypeError, ValueError) as e:
+                    detail = e.detail if isinstance(e, HTTPException) else "Invalid message"
+                    connection.send({"type": "error", "temp_id": temp_id, "detail": detail})
+                    continue
+                
+                connection.partners[message_response.conversation_id] = recipient_id
+                connection.send({
+                    "type": "ack",
+                    "temp_id": temp_id,
+                    "data": message_response.model_dump(mode="json")
+                })
+            
+            elif frame_type == "typing":
+                try:
+                    conversation_id = int(data.get("conversation_id"))
+                    recipient_id = connection.partners.get(conversation_id)
+                    if recipient_id is None:
+                        recipient_id = await run_in_threadpool(
+                            _ws_conversation_partner, current_user, conversation_id
+                        )
+                        connection.partners[conversation_id] = recipient_id
+                except (HTTPException, TypeError, ValueError):
+                    continue
+                await manager.send_typing(conversation_id, user_id, recipient_id)
             
-            if data.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+            elif frame_type == "mark_read":
+                try:
+                    _, message_ids = await run_in_threadpool(_ws_mark_read, current_user, data)
+                except (HTTPException, TypeError, ValueError) as e:
+                    detail = e.detail if isinstance(e, HTTPException) else "Invalid conversation"
+                    connection.send({"type": "error", "detail": detail})
+                    continue
+                
+                connection.send({
+                    "type": "read_ack",
+                    "conversation_id": int(data.get("conversation_id")),
+                    "message_ids": message_ids or []
+                })
             
-    except WebSocketDisconnect:
-        manager.disconnect(user_id)
\ No newline at end of file
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the socket was closed by the server (slow consumer, limits)
+        pass
+    finally:
+        manager.disconnect(connection)
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 
 from app.auth.models import User
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.auth.oauth2 import get_current_user
 from app.auth.kyc_schemas import KYCSubmission, KYCStatusUpdate, KYCDisplay, AgentWarning
 from app.auth import kyc
@@ -31,7 +32,7 @@ def submit_kyc_info(request: KYCSubmission, db: Session = Depends(get_db), curre
 async def upload_kyc_documents(
     government_id: UploadFile = File(..., description="Government issued ID (passport, driver's license, or national ID)"),
     selfie: UploadFile = File(..., description="Selfie holding the ID document"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """Upload KYC documents (government ID and selfie)"""
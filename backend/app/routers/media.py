@@ -0,0 +1,59 @@
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import FileResponse
+
+from app.storage import INLINE_TYPES, LocalStorage, get_storage, media_type_of
+
+
+router = APIRouter(
+    prefix="/media",
+    tags=["media"],
+)
+
+# Local paths are content-addressed, so a URL never changes content
+CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+# Browsers must not guess a type that would run as active content
+SAFE_HEADERS = {**CACHE_HEADERS, "X-Content-Type-Options": "nosniff"}
+
+
+@router.get("/{public_id:path}")
+def serve_media(public_id: str):
+    """
+    Serve a locally stored media file (supports Range requests).
+
+    Only allowlisted image types are shown inline; PDFs and anything else
+    are sent as downloads, so nothing stored here renders as a page on the
+    API origin.
+    """
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Media is not served by this backend"
+        )
+
+    try:
+        path = storage.resolve(public_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+
+    if not path.is_file():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+
+    media_type = media_type_of(public_id)
+    if media_type in INLINE_TYPES:
+        # FileResponse streams from disk (pathsend when the server supports it)
+        # and answers Range / If-None-Match itself
+        return FileResponse(path, media_type=media_type, headers=SAFE_HEADERS)
+    return FileResponse(
+        path,
+        media_type=media_type or "application/octet-stream",
+        filename=path.name,
+        content_disposition_type="attachment",
+        headers=SAFE_HEADERS
+    )
@@ -0,0 +1,142 @@
+import asyncio
+import json
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from app.database import SessionLocal
+from app.auth.oauth2 import get_user_from_token
+from app.chat.chat import manager
+from app.chat.counters import COUNTER_FIELDS, get_chat_counter
+from app.chat.events import notification_payload
+from app.chat.models import Notification
+
+
+router = APIRouter(
+    prefix="/notifications",
+    tags=["notifications"],
+)
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+# Most notifications replayed after a reconnect
+REPLAY_LIMIT = 100
+
+
+def format_sse(message: dict) -> str:
+    lines = [f"event: {message.get('type', 'message')}"]
+    # Only notifications carry ids, so Last-Event-ID always names the last one seen
+    if message.get("type") == "notification":
+        lines.append(f"id: {message['data']['id']}")
+    elif message.get("type") == "notification_digest":
+        lines.append(f"id: {max(n['id'] for n in message['data']['notifications'])}")
+    lines.append(f"data: {json.dumps(message.get('data', {}))}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _authenticate_stream(token: str) -> int:
+    with SessionLocal() as db:
+        return get_user_from_token(token, db).id
+
+
+def _load_backlog(user_id: int, last_event_id: Optional[int]):
+    """What a reconnecting client missed, plus current counter totals"""
+    with SessionLocal() as db:
+        missed = []
+        if last_event_id is not None:
+            missed = db.query(Notification).filter(
+                Notification.user_id == user_id,
+                Notification.id > last_event_id
+            ).order_by(Notification.id).limit(REPLAY_LIMIT).all()
+
+        counter = get_chat_counter(db, user_id)
+        totals = {field: getattr(counter, field) for field in COUNTER_FIELDS}
+        return [notification_payload(n) for n in missed], totals
+
+
+def _drop_replayed(message: dict, replayed: set) -> Optional[dict]:
+    """Leave out notifications already sent from the backlog (queued while it was loaded)"""
+    if not replayed:
+        return message
+    if message.get("type") == "notification":
+        return None if message["data"]["id"] in replayed else message
+    if message.get("type") == "notification_digest":
+        notifications = [n for n in message["data"]["notifications"] if n["id"] not in replayed]
+        if not notifications:
+            return None
+        return {**message, "data": {**message["data"], "notifications": notifications}}
+    return message
+
+
+@router.get("/stream")
+async def notification_stream(
+    request: Request,
+    token: Optional[str] = Query(None, description="Access token (EventSource cannot send headers)"),
+    authorization: Optional[str] = Header(None),
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Server-sent events for notifications and badge counters.
+
+    Events: `notification` (a new Notification row, id = notification id),
+    `notification_digest` (several batched, when NOTIFICATION_DIGEST_SECONDS is set),
+    `counters` ({"delta": {...}} as counters change, {"totals": {...}} on
+    connect) and `visit` (a visit changed status). Reconnecting with
+    Last-Event-ID replays missed notifications.
+    """
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_id = None
+
+    user_id = await run_in_threadpool(_authenticate_stream, token)
+
+    # Subscribe before loading the backlog so nothing committed in between is
+    # lost; what arrives twice is dropped by id
+    queue = await manager.subscribe_stream(user_id)
+    try:
+        missed, totals = await run_in_threadpool(_load_backlog, user_id, last_id)
+    except Exception:
+        manager.unsubscribe_stream(queue, user_id)
+        raise
+    replayed = {payload["id"] for payload in missed}
+
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            for payload in missed:
+                yield format_sse({"type": "notification", "data": payload})
+            yield format_sse({"type": "counters", "data": {"totals": totals}})
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    # Fell too far behind; the client reconnects and resumes
+                    break
+                message = _drop_replayed(message, replayed)
+                if message is not None:
+                    yield format_sse(message)
+        finally:
+            manager.unsubscribe_stream(queue, user_id)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
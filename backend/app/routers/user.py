@@ -1,15 +1,18 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.auth.oauth2 import oauth2_schema
 
 from app.auth import user
 
 
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.auth.schemas import UserBase, UserDisplay, UserLogin, Token, RefreshTokenRequest
 from app.auth.oauth2 import create_access_token, decode_refresh_token, generate_refresh_token, get_current_user
 from app.auth.models import User
+from app.auth.rate_limit import login_throttle
 
 
 router = APIRouter(
@@ -18,13 +21,15 @@ router = APIRouter(
 )
 
 @router.post("/register", response_model=UserDisplay)
-async def create_user(request: UserBase, db: Session = Depends(get_db)):
+async def create_user(request: UserBase, db: AsyncSession = Depends(get_async_db)):
     return await user.create_user(db, request)
 
 
 @router.post("/login", response_model=Token)
-def login(request: UserLogin, db: Session = Depends(get_db)):
-    return user.login_user(db, request.username, request.password)
+async def login(request: UserLogin, http_request: Request, db: AsyncSession = Depends(get_async_db)):
+    # Throttle before any bcrypt work is spent on the attempt
+    login_throttle.check(http_request.client.host if http_request.client else "unknown", request.username)
+    return await user.login_user(db, request.username, request.password)
 
 
 @router.post("/refresh", response_model=Token)
@@ -51,7 +56,7 @@ def refresh_access_token(request: RefreshTokenRequest):
 
 
 @router.get("/verify-email")
-async def verify_email(token: str, db: Session = Depends(get_db)):
+async def verify_email(token: str, db: AsyncSession = Depends(get_async_db)):
     return await user.verify_email(token, db)
 
 
@@ -77,9 +82,9 @@ def get_user_by_id(
 
 
 @router.post("/resend-verification")
-async def resend_verification_email(email: str, db: Session = Depends(get_db)):
+async def resend_verification_email(email: str, db: AsyncSession = Depends(get_async_db)):
     """Resend verification email"""
-    user_obj = db.query(User).filter(User.email == email).first()
+    user_obj = (await db.execute(select(User).where(User.email == email))).scalars().first()
     if not user_obj:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+
+MEDIA_STORAGE = os.environ.get("MEDIA_STORAGE", "cloudinary")  # cloudinary or local
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", os.path.join(os.getcwd(), "media"))
+MEDIA_URL = os.environ.get("MEDIA_URL", "/media").rstrip("/")
+
+CHUNK_SIZE = 1024 * 1024
+
+# The only extensions stored files get, keyed by media type. They come from
+# the file's leading bytes, never from the client's filename.
+STORED_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "application/pdf": ".pdf",
+}
+# Served inline; every other stored file is sent as a download
+INLINE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+
+
+def sniff_media_type(head: bytes) -> Optional[str]:
+    """Media type from a file's first bytes, for the types we store with an extension"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    return None
+
+
+def media_type_of(public_id: str) -> Optional[str]:
+    """Media type of a stored file, from its (allowlisted) extension"""
+    extension = os.path.splitext(public_id)[1].lower()
+    for media_type, stored_extension in STORED_EXTENSIONS.items():
+        if extension == stored_extension:
+            return media_type
+    return None
+
+
+class MediaStorage(ABC):
+    """Interface for media backends. Results mirror Cloudinary's upload keys."""
+
+    @abstractmethod
+    def upload(self, file: BinaryIO, folder: str, resource_type: str = "image", filename: Optional[str] = None) -> dict:
+        """Store a file; returns secure_url, public_id, bytes and format"""
+
+    @abstractmethod
+    def delete(self, public_id: str, resource_type: str = "image") -> None:
+        """Remove a stored file"""
+
+
+class CloudinaryStorage(MediaStorage):
+    def __init__(self):
+        import cloudinary
+        import cloudinary.uploader
+
+        cloudinary.config(
+            cloud_name = os.environ.get("CLOUDINARY_CLOUD_NAME"),
+            api_key = os.environ.get("CLOUDINARY_API_KEY"),
+            api_secret = os.environ.get("CLOUDINARY_API_SECRET")
+        )
+        self.uploader = cloudinary.uploader
+
+    def upload(self, file: BinaryIO, folder: str, resource_type: str = "image", filename: Optional[str] = None) -> dict:
+        result = self.uploader.upload(file, folder=folder, resource_type=resource_type)
+        return {
+            "secure_url": result["secure_url"],
+            "public_id": result["public_id"],
+            "bytes": result.get("bytes"),
+            "format": result.get("format"),
+        }
+
+    def delete(self, public_id: str, resource_type: str = "image") -> None:
+        self.uploader.destroy(public_id, resource_type=resource_type)
+
+
+class LocalStorage(MediaStorage):
+    """
+    Stores files on local disk under content-addressed paths.
+    The same bytes uploaded to the same folder always map to the same file,
+    so files are immutable and can be cached forever by clients.
+    """
+
+    def __init__(self, root: str = MEDIA_ROOT, base_url: str = MEDIA_URL):
+        self.root = Path(root).resolve()
+        self.base_url = base_url
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def upload(self, file: BinaryIO, folder: str, resource_type: str = "image", filename: Optional[str] = None) -> dict:
+        tmp_dir = self.root / ".tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+
+        # Hash while streaming to a temp file so large uploads never sit in memory
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        tmp = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        try:
+            with tmp:
+                while True:
+                    chunk = file.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if not head:
+                        head = chunk[:16]
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+
+            # The client's filename can't choose how the file is served later
+            extension = STORED_EXTENSIONS.get(sniff_media_type(head), "")
+            content_hash = digest.hexdigest()
+            public_id = f"{folder.strip('/')}/{content_hash[:2]}/{content_hash}{extension}"
+            target = self.resolve(public_id)
+            target.parent.mkdir(parents=True, exist_ok=True)
+
+            if not target.exists():
+                shutil.move(tmp.name, target)
+        finally:
+            if os.path.exists(tmp.name):
+                os.unlink(tmp.name)
+
+        return {
+            "secure_url": f"{self.base_url}/{public_id}",
+            "public_id": public_id,
+            "bytes": size,
+            "format": extension.lstrip(".") or None,
+        }
+
+    def delete(self, public_id: str, resource_type: str = "image") -> None:
+        target = self.resolve(public_id)
+        if target.is_file():
+            target.unlink()
+
+    def resolve(self, public_id: str) -> Path:
+        """Map a public id to a path, refusing anything outside the media root"""
+        path = (self.root / public_id).resolve()
+        if self.root not in path.parents:
+            raise ValueError("Invalid media path")
+        return path
+
+
+_storage: Optional[MediaStorage] = None
+
+
+def get_storage() -> MediaStorage:
+    """Return the configured media backend (MEDIA_STORAGE=cloudinary|local)"""
+    global _storage
+    if _storage is None:
+        if MEDIA_STORAGE == "local":
+            _storage = LocalStorage()
+        elif MEDIA_STORAGE == "cloudinary":
+            _storage = CloudinaryStorage()
+        else:
+            raise RuntimeError(f"Unknown MEDIA_STORAGE backend: {MEDIA_STORAGE}")
+    return _storage
@@ -1,18 +1,57 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.database import Base, engine
-from app.routers import user, property, admin, chat, visits, kyc, reviews
+from app.database import Base, engine, SessionLocal
+from app.routers import user, property, admin, chat, visits, kyc, reviews, media, notifications
 from app.auth.models import User, AgentProfile, ActivityLog
 from app.property.models import UserProperty, PropertyImage, Favorite, VisitRequest, PropertyReservation, AgentReview
-from app.chat.models import Conversation, Message, Notification
+from app.chat.models import Conversation, Message, Notification, ChatCounter, ChatEvent, MessageAttachment, ArchiveSegment
+from app.chat.chat import manager, backfill_conversation_read_model
+from app.chat.counters import run_counter_reconciler
+from app.chat.archive import run_archiver
+from app.loop_monitor import monitor as loop_monitor
+from app.auth.hash import password_hasher
+from app.auth.principal_cache import principal_cache
+from app.auth.revocation import run_revocation_refresher
+from app.chat.search import ensure_search_index
+from app.migrations import add_missing_columns
 from fastapi.middleware.cors import CORSMiddleware
 
 
 Base.metadata.create_all(bind=engine)
+# Columns and indexes added to existing tables, before the backfill reads them
+add_missing_columns(engine)
+ensure_search_index(engine)
+
+with SessionLocal() as db:
+    backfill_conversation_read_model(db)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Watch for anything blocking the event loop
+    await loop_monitor.start()
+    # Subscribe this worker to the chat backplane (if configured)
+    await manager.start()
+    # Periodically correct drift in the chat badge counters
+    reconciler = asyncio.create_task(run_counter_reconciler(SessionLocal))
+    # Move old read messages and notifications out of the hot tables
+    archiver = asyncio.create_task(run_archiver(SessionLocal))
+    # Keep the in-memory token revocation index current and the table small
+    revocation_refresher = asyncio.create_task(run_revocation_refresher(SessionLocal))
+    yield
+    revocation_refresher.cancel()
+    reconciler.cancel()
+    archiver.cancel()
+    await manager.stop()
+    await loop_monitor.stop()
+
 
 app = FastAPI(
     title="Real Estate API",
     description="A comprehensive real estate management system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 origins = [
@@ -38,6 +77,26 @@ app.include_router(chat.router)
 app.include_router(visits.router)
 app.include_router(kyc.router)
 app.include_router(reviews.router)
+app.include_router(media.router)
+app.include_router(notifications.router)
+
+@app.get("/metrics/event-loop")
+def event_loop_metrics():
+    """Event loop lag histogram for this worker"""
+    return loop_monitor.snapshot()
+
+
+@app.get("/metrics/password-hashing")
+def password_hashing_metrics():
+    """Queue and timing figures for this worker's password hashing pool"""
+    return password_hasher.snapshot()
+
+
+@app.get("/metrics/auth-cache")
+def auth_cache_metrics():
+    """Size and hit rates of this worker's authenticated-principal cache"""
+    return principal_cache.snapshot()
+
 
 @app.get("/")
 def read_root():
@@ -7,6 +7,12 @@ let currentUser = null;
 let messageQueue = new Map(); // Track pending messages
 let tempMessageId = 0; // Temporary ID counter for optimistic messages
 let lastRenderedMessageCount = 0; // Track rendered messages for efficient updates
+let lastEventId = null; // Newest server event seen, replayed from on reconnect
+let seenEventIds = new Set(); // Replayed events may overlap live ones
+let lastTypingSentAt = 0; // Throttle outgoing typing signals
+let typingTimeout = null;
+let chatHeaderStatus = ''; // Property line shown under the other user's name
+let attachmentCache = new Map(); // Attachment details by id, loaded lazily
 
 document.addEventListener('DOMContentLoaded', async () => {
     console.log('Chat page loaded');
@@ -116,6 +122,8 @@ function setupEventListeners() {
         
         // Enable/disable send button
         sendBtn.disabled = !messageInput.value.trim();
+        
+        sendTypingSignal();
     });
     
     messageInput.addEventListener('keydown', (e) => {
@@ -129,6 +137,17 @@ function setupEventListeners() {
     
     sendBtn.addEventListener('click', sendMessage);
     
+    // Attachments: upload first, then send a message referencing the upload
+    const attachBtn = document.getElementById('attach-file-btn');
+    const attachmentInput = document.getElementById('attachment-input');
+    attachBtn.disabled = false;
+    attachBtn.addEventListener('click', () => attachmentInput.click());
+    attachmentInput.addEventListener('change', () => {
+        const file = attachmentInput.files[0];
+        attachmentInput.value = '';
+        if (file) sendAttachment(file);
+    });
+    
     // Close chat button (mobile)
     document.getElementById('close-chat-btn').addEventListener('click', () => {
         closeActiveChat();
@@ -303,7 +322,8 @@ async function loadConversation(conversationId) {
         userNameEl.onclick = () => viewChatUserProfile();
         userNameEl.style.cursor = 'pointer';
         
-        document.getElementById('chat-property-info').textContent = conversationData.property_title;
+        chatHeaderStatus = conversationData.property_title + (conversationData.other_user_online ? ' · Online' : '');
+        document.getElementById('chat-property-info').textContent = chatHeaderStatus;
         
         // Render messages
         renderMessages(conversationData.messages);
@@ -556,12 +576,58 @@ function createMessageElement(msg) {
     }
     
     bubble.appendChild(content);
+    if (msg.attachment_ids && msg.attachment_ids.length) {
+        const attachments = document.createElement('div');
+        attachments.className = 'message-attachments';
+        bubble.appendChild(attachments);
+        loadAttachments(attachments, msg.attachment_ids);
+    }
     bubble.appendChild(timeSpan);
     div.appendChild(bubble);
     
     return div;
 }
 
+// Messages carry attachment ids only; details are fetched on render and cached
+async function loadAttachments(container, attachmentIds) {
+    const missing = attachmentIds.filter(id => !attachmentCache.has(id));
+    if (missing.length) {
+        try {
+            const query = missing.map(id => `ids=${id}`).join('&');
+            const attachments = await apiCall(`/chat/attachments?${query}`);
+            attachments.forEach(attachment => attachmentCache.set(attachment.id, attachment));
+        } catch (error) {
+            console.error('Failed to load attachments:', error);
+        }
+    }
+    
+    attachmentIds.forEach(id => {
+        const attachment = attachmentCache.get(id);
+        if (attachment) container.appendChild(createAttachmentElement(attachment));
+    });
+}
+
+function createAttachmentElement(attachment) {
+    const link = document.createElement('a');
+    link.className = `message-attachment attachment-${attachment.kind}`;
+    link.href = attachment.url.startsWith('/') ? `${API_BASE_URL}${attachment.url}` : attachment.url;
+    link.target = '_blank';
+    link.rel = 'noopener';
+    
+    if (attachment.kind === 'image') {
+        const img = document.createElement('img');
+        const src = attachment.thumbnail_url || attachment.url;
+        img.src = src.startsWith('/') ? `${API_BASE_URL}${src}` : src;
+        img.alt = attachment.filename || 'Image';
+        img.loading = 'lazy';
+        link.appendChild(img);
+    } else {
+        const pages = attachment.page_count ? ` (${attachment.page_count} pages)` : '';
+        link.textContent = `📄 ${attachment.title || attachment.filename || 'Document'}${pages}`;
+    }
+    return link;
+}
+
 function getStatusIcon(state) {
     switch(state) {
         case 'sending':
@@ -583,6 +649,42 @@ async function sendMessage() {
     
     if (!content) return;
     
+    dispatchOutgoingMessage(content);
+}
+
+async function sendAttachment(file) {
+    if (!currentConversationId) return;
+    
+    const conversationId = currentConversationId;
+    const formData = new FormData();
+    formData.append('file', file);
+    
+    try {
+        const token = localStorage.getItem('authToken');
+        const response = await fetch(`${API_BASE_URL}/chat/conversations/${conversationId}/attachments`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${token}` },
+            body: formData
+        });
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.detail || 'Failed to upload attachment');
+        }
+        const attachment = await response.json();
+        attachmentCache.set(attachment.id, attachment);
+        
+        // The typed text (if any) becomes the caption
+        const input = document.getElementById('message-input');
+        const content = input.value.trim() || file.name;
+        dispatchOutgoingMessage(content, [attachment.id]);
+    } catch (error) {
+        console.error('Failed to upload attachment:', error);
+        showNotification(error.message, 'error');
+    }
+}
+
+function dispatchOutgoingMessage(content, attachmentIds = []) {
+    const input = document.getElementById('message-input');
     const sendBtn = document.getElementById('send-message-btn');
     
     // Generate temporary message ID
@@ -594,6 +696,7 @@ async function sendMessage() {
         id: null,
         temp_id: tempId,
         content: content,
+        attachment_ids: attachmentIds,
         sender_id: currentUser.user_id,
         conversation_id: currentConversationId,
         created_at: now,
@@ -615,16 +718,34 @@ async function sendMessage() {
     // Store in queue for tracking
     messageQueue.set(tempId, { message: optimisticMessage, retries: 0 });
     
-    // 🚀 Non-blocking network request in background
-    sendMessageToBackend(tempId, content, currentConversationId);
+    // 🚀 Send over the open WebSocket (acked with the saved id), HTTP otherwise
+    if (!sendMessageOverSocket(tempId, content, currentConversationId, attachmentIds)) {
+        sendMessageToBackend(tempId, content, currentConversationId, attachmentIds);
+    }
+}
+
+function sendMessageOverSocket(tempId, content, conversationId, attachmentIds = []) {
+    if (!websocket || websocket.readyState !== WebSocket.OPEN) return false;
+    
+    websocket.send(JSON.stringify({
+        type: 'send_message',
+        temp_id: tempId,
+        conversation_id: conversationId,
+        content: content,
+        attachment_ids: attachmentIds
+    }));
+    
+    const queueItem = messageQueue.get(tempId);
+    if (queueItem) queueItem.viaSocket = true;
+    return true;
 }
 
 // Separate function for background network request
-async function sendMessageToBackend(tempId, content, conversationId) {
+async function sendMessageToBackend(tempId, content, conversationId, attachmentIds = []) {
     try {
         const message = await apiCall(`/chat/conversations/${conversationId}/messages`, {
             method: 'POST',
-            body: JSON.stringify({ content })
+            body: JSON.stringify({ content, attachment_ids: attachmentIds })
         });
         
         // Update message state to 'sent'
@@ -641,14 +762,14 @@ async function sendMessageToBackend(tempId, content, conversationId) {
             // Retry logic
             queueItem.retries++;
             console.log(`Retrying message ${tempId}, attempt ${queueItem.retries}`);
-            setTimeout(() => sendMessageToBackend(tempId, content, conversationId), 2000 * queueItem.retries);
+            setTimeout(() => sendMessageToBackend(tempId, content, conversationId, attachmentIds), 2000 * queueItem.retries);
         } else {
             // Mark as failed after 3 retries
             updateMessageState(tempId, 'failed');
             messageQueue.delete(tempId);
             
             // Show retry option
-            showMessageRetryOption(tempId, content, conversationId);
+            showMessageRetryOption(tempId, content, conversationId, attachmentIds);
         }
     }
 }
@@ -705,7 +826,7 @@ function updateMessageState(tempId, newState, realId = null) {
 }
 
 // Show retry option for failed messages
-function showMessageRetryOption(tempId, content, conversationId) {
+function showMessageRetryOption(tempId, content, conversationId, attachmentIds = []) {
     const msgElement = document.querySelector(`[data-message-id="${tempId}"]`);
     if (msgElement) {
         const bubble = msgElement.querySelector('.message-bubble');
@@ -718,7 +839,7 @@ function showMessageRetryOption(tempId, content, conversationId) {
             retryBtn.remove();
             updateMessageState(tempId, 'sending');
             messageQueue.set(tempId, { message: { content, temp_id: tempId }, retries: 0 });
-            sendMessageToBackend(tempId, content, conversationId);
+            sendMessageToBackend(tempId, content, conversationId, attachmentIds);
         };
         
         bubble.appendChild(retryBtn);
@@ -802,7 +923,12 @@ function connectWebSocket() {
     if (!currentUser) return;
     
     const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${wsProtocol}//${window.location.hostname}:8000/chat/ws/${currentUser.user_id}`;
+    const token = localStorage.getItem('authToken');
+    let wsUrl = `${wsProtocol}//${window.location.hostname}:8000/chat/ws/${currentUser.user_id}?token=${encodeURIComponent(token)}`;
+    if (lastEventId !== null) {
+        // Only fetch what was missed while disconnected
+        wsUrl += `&since=${lastEventId}`;
+    }
     
     try {
         websocket = new WebSocket(wsUrl);
@@ -819,7 +945,9 @@ function connectWebSocket() {
         
         websocket.onmessage = (event) => {
             const data = JSON.parse(event.data);
-            handleWebSocketMessage(data);
+            // Events sent close together arrive in a single batch frame
+            const events = data.type === 'batch' ? data.events : [data];
+            events.forEach(processWebSocketEvent);
         };
         
         websocket.onerror = (error) => {
@@ -828,6 +956,14 @@ function connectWebSocket() {
         
         websocket.onclose = () => {
             console.log('WebSocket disconnected, reconnecting...');
+            // Messages sent over the socket without an ack may not have been saved
+            messageQueue.forEach((item, tempId) => {
+                if (item.viaSocket) {
+                    updateMessageState(tempId, 'failed');
+                    messageQueue.delete(tempId);
+                    showMessageRetryOption(tempId, item.message.content, item.message.conversation_id, item.message.attachment_ids);
+                }
+            });
             // Reconnect after 5 seconds
             setTimeout(connectWebSocket, 5000);
         };
@@ -837,6 +973,20 @@ function connectWebSocket() {
     }
 }
 
+function processWebSocketEvent(data) {
+    if (data.event_id !== undefined) {
+        if (seenEventIds.has(data.event_id)) {
+            return;
+        }
+        seenEventIds.add(data.event_id);
+        if (seenEventIds.size > 1000) {
+            seenEventIds.delete(seenEventIds.values().next().value);
+        }
+        lastEventId = Math.max(lastEventId || 0, data.event_id);
+    }
+    handleWebSocketMessage(data);
+}
+
 function handleWebSocketMessage(data) {
     switch (data.type) {
         case 'message':
@@ -845,12 +995,44 @@ function handleWebSocketMessage(data) {
         case 'notification':
             handleNotification(data.data);
             break;
+        case 'notification_digest':
+            // Several notifications batched server-side; refresh once
+            handleNotification(data.data.notifications[data.data.notifications.length - 1]);
+            break;
+        case 'counters':
+        case 'visit':
+            // Badges and visits are handled by the notification stream
+            break;
         case 'read_receipt':
             handleReadReceipt(data);
             break;
+        case 'ack':
+            // Server saved a message we sent over the socket
+            updateMessageState(data.temp_id, 'sent', data.data.id);
+            messageQueue.delete(data.temp_id);
+            break;
+        case 'error':
+            handleSocketError(data);
+            break;
+        case 'read_ack':
+            break;
+        case 'typing':
+            handleTyping(data);
+            break;
+        case 'resync':
+            // Too much was missed to replay; reload instead
+            loadConversations();
+            if (currentConversationId) {
+                loadConversation(currentConversationId);
+            }
+            break;
         case 'pong':
             // Keep-alive response
             break;
+        case 'ping':
+            // Server heartbeat; silent sockets get closed
+            websocket.send(JSON.stringify({ type: 'pong' }));
+            break;
         default:
             console.log('Unknown message type:', data.type);
     }
@@ -953,6 +1135,25 @@ async function showBrowserNotification(messageData) {
     }
 }
 
+function sendTypingSignal() {
+    const now = Date.now();
+    if (!currentConversationId || now - lastTypingSentAt < 2000) return;
+    if (websocket && websocket.readyState === WebSocket.OPEN) {
+        websocket.send(JSON.stringify({ type: 'typing', conversation_id: currentConversationId }));
+        lastTypingSentAt = now;
+    }
+}
+
+function handleTyping(data) {
+    if (data.conversation_id !== currentConversationId) return;
+    const infoEl = document.getElementById('chat-property-info');
+    infoEl.textContent = 'typing...';
+    clearTimeout(typingTimeout);
+    typingTimeout = setTimeout(() => {
+        infoEl.textContent = chatHeaderStatus;
+    }, 3000);
+}
+
 function handleNotification(notificationData) {
     // Show toast notification
     showToast(notificationData.title, 'info');
@@ -961,6 +1162,16 @@ function handleNotification(notificationData) {
     loadConversations();
 }
 
+function handleSocketError(data) {
+    console.error('WebSocket error frame:', data.detail);
+    const queueItem = data.temp_id ? messageQueue.get(data.temp_id) : null;
+    if (queueItem) {
+        updateMessageState(data.temp_id, 'failed');
+        messageQueue.delete(data.temp_id);
+        showMessageRetryOption(data.temp_id, queueItem.message.content, queueItem.message.conversation_id, queueItem.message.attachment_ids);
+    }
+}
+
 function handleReadReceipt(data) {
     // Mark messages as read in UI if needed
     console.log('Messages read:', data.message_ids);
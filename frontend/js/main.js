@@ -714,6 +714,8 @@ class NotificationManager {
         this.isSupported = 'Notification' in window;
         this.permission = this.isSupported ? Notification.permission : 'denied';
         this.updateInterval = null;
+        this.eventSource = null;
+        this.counters = { unread_messages: 0, unread_notifications: 0 };
     }
 
     async requestPermission() {
@@ -833,6 +835,72 @@ class NotificationManager {
         });
     }
 
+    applyCounters(data) {
+        if (data.totals) {
+            Object.assign(this.counters, data.totals);
+        }
+        if (data.delta) {
+            Object.entries(data.delta).forEach(([field, delta]) => {
+                this.counters[field] = Math.max(0, (this.counters[field] || 0) + delta);
+            });
+        }
+        this.updateMessagesBadge(this.counters.unread_messages);
+        this.updateNotificationsBadge(this.counters.unread_notifications);
+    }
+
+    // Live badges and notifications over server-sent events; returns false if unavailable
+    startStream() {
+        if (!('EventSource' in window)) {
+            return false;
+        }
+
+        const token = localStorage.getItem('authToken');
+        if (!token) {
+            return false;
+        }
+
+        this.eventSource = new EventSource(
+            `${API_BASE_URL}/notifications/stream?token=${encodeURIComponent(token)}`
+        );
+
+        this.eventSource.addEventListener('counters', (event) => {
+            this.applyCounters(JSON.parse(event.data));
+        });
+
+        this.eventSource.addEventListener('notification', (event) => {
+            const notification = JSON.parse(event.data);
+            this.showBrowserNotification(notification.title, {
+                body: notification.body,
+                tag: `notification-${notification.id}`,
+                url: notification.conversation_id ? 'chat.html' : undefined
+            });
+        });
+
+        this.eventSource.addEventListener('notification_digest', (event) => {
+            const { notifications } = JSON.parse(event.data);
+            const latest = notifications[notifications.length - 1];
+            this.showBrowserNotification(
+                notifications.length > 1 ? `${notifications.length} new notifications` : latest.title,
+                { body: latest.body, tag: 'notification-digest' }
+            );
+        });
+
+        this.eventSource.addEventListener('visit', (event) => {
+            // Pages showing visits update in place instead of refetching
+            window.dispatchEvent(new CustomEvent('visit-update', { detail: JSON.parse(event.data) }));
+        });
+
+        this.eventSource.onerror = () => {
+            // EventSource retries on its own; only fall back once it gives up
+            if (this.eventSource && this.eventSource.readyState === EventSource.CLOSED) {
+                this.eventSource = null;
+                this.startPolling(30);
+            }
+        };
+
+        return true;
+    }
+
     startPolling(intervalSeconds = 30) {
         // Check immediately
         this.checkUnreadMessages();
@@ -850,6 +918,10 @@ class NotificationManager {
             clearInterval(this.updateInterval);
             this.updateInterval = null;
         }
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
     }
 }
 
@@ -865,8 +937,10 @@ document.addEventListener('DOMContentLoaded', async () => {
         setTimeout(async () => {
             await notificationManager.requestPermission();
             
-            // Start polling for updates
-            notificationManager.startPolling(30); // Check every 30 seconds
+            // Stream updates; poll only where the stream is unavailable
+            if (!notificationManager.startStream()) {
+                notificationManager.startPolling(30); // Check every 30 seconds
+            }
         }, 2000);
 
         // Setup notifications button click handler (for all users - agents and buyers)
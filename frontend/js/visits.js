@@ -23,6 +23,21 @@ document.addEventListener('DOMContentLoaded', async () => {
     await loadVisits();
 });
 
+// Live visit updates pushed by the notification stream (see main.js)
+window.addEventListener('visit-update', (event) => {
+    const visit = event.detail.visit;
+    const index = allVisits.findIndex(v => v.id === visit.id);
+    if (index === -1) {
+        allVisits.unshift(visit);
+    } else {
+        allVisits[index] = visit;
+    }
+
+    document.getElementById('empty-state').style.display = 'none';
+    document.getElementById('visits-list').style.display = 'grid';
+    displayVisits(filterVisits());
+});
+
 function setupFilterTabs() {
     const filterTabs = document.querySelectorAll('.filter-tab');
     